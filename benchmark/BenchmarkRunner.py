@@ -0,0 +1,221 @@
+#	bulkscan - Document scanning and maintenance solution
+#	Copyright (C) 2019-2023 Johannes Bauer
+#
+#	This file is part of bulkscan.
+#
+#	bulkscan is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	bulkscan is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with bulkscan; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import sys
+import time
+import shutil
+import platform
+import tempfile
+import datetime
+import statistics
+import subprocess
+import doclib
+from .CorpusGenerator import CorpusGenerator
+
+class BenchmarkRunner():
+	def __init__(self, args):
+		self._args = args
+		self._results = { }
+		self._workdir = None
+		self._basedir = os.path.realpath(os.path.dirname(__file__) + "/..")
+
+	def _log(self, msg):
+		if self._args.verbose:
+			print(msg, file = sys.stderr)
+
+	def _measure(self, name, fnc, setup = None, repeat = None):
+		if (self._args.only is not None) and (name not in self._args.only):
+			return
+		if repeat is None:
+			repeat = self._args.repeat
+		timings = [ ]
+		for i in range(repeat):
+			fnc_args = setup() if (setup is not None) else ()
+			t0 = time.perf_counter()
+			fnc(*fnc_args)
+			t1 = time.perf_counter()
+			timings.append(t1 - t0)
+		self._results[name] = {
+			"repeat":	repeat,
+			"min":		min(timings),
+			"median":	statistics.median(timings),
+			"mean":		statistics.mean(timings),
+			"max":		max(timings),
+		}
+		self._log("%-32s median %8.3f sec, min %8.3f sec" % (name, self._results[name]["median"], self._results[name]["min"]))
+
+	def _generator(self):
+		return CorpusGenerator(width = self._args.width, height = self._args.height, resolution_dpi = self._args.resolution, seed = self._args.seed)
+
+	def _fresh_dir(self, name):
+		dirname = self._workdir + "/" + name
+		shutil.rmtree(dirname, ignore_errors = True)
+		os.makedirs(dirname)
+		return dirname
+
+	def _bench_multidoc(self, incoming_dir, incoming_files):
+		def setup():
+			filename = self._workdir + "/add.mud"
+			if os.path.exists(filename):
+				os.unlink(filename)
+			return (filename, )
+
+		def add(filename):
+			with doclib.MultiDoc(filename) as doc:
+				for incoming_file in incoming_files:
+					doc.add(incoming_dir + "/" + incoming_file)
+		self._measure("multidoc_add", add, setup = setup)
+
+		def read(filename):
+			with doclib.MultiDoc(filename) as doc:
+				for side_uuid in doc.get_page_order():
+					doc.get_side_images_info(side_uuid)
+					doc.get_page_image(side_uuid)
+		self._measure("multidoc_read", read, setup = lambda: (self._workdir + "/add.mud", ))
+
+	def _bench_library(self, library_dir):
+		def add_directory():
+			library = doclib.DocLibrary()
+			library.add_directory(library_dir)
+		self._measure("doclibrary_add_directory", add_directory)
+
+	def _create_controller(self, incoming_dir):
+		try:
+			from scanui.Controller import Controller
+		except ImportError as e:
+			print("Skipping controller benchmarks, cannot import scanui: %s" % (str(e)), file = sys.stderr)
+			return None
+		config = {
+			"incoming_dir":			incoming_dir,
+			"thumb_dir":			self._fresh_dir("thumbs"),
+			"trash_dir":			self._fresh_dir("trash"),
+			"doc_dir":				self._workdir + "/library",
+			"processed_dir":		self._fresh_dir("processed"),
+			"autocomplete_config":	self._workdir + "/autocomplete.json",
+		}
+		ctrlr = Controller(app = None)
+		ctrlr.set_config(config)
+		return ctrlr
+
+	def _bench_controller(self, incoming_dir, incoming_files):
+		ctrlr = self._create_controller(incoming_dir)
+		if ctrlr is None:
+			return
+
+		self._measure("list_documents", ctrlr.list_documents)
+		self._measure("list_incoming", ctrlr.list_incoming)
+
+		def get_thumbs():
+			for filename in incoming_files:
+				ctrlr.get_thumb(filename)
+		def setup_cold():
+			shutil.rmtree(ctrlr.config["thumb_dir"])
+			os.makedirs(ctrlr.config["thumb_dir"])
+			return ()
+		self._measure("get_thumb_cold", get_thumbs, setup = setup_cold)
+		self._measure("get_thumb_warm", get_thumbs)
+
+		def setup_create():
+			for filename in os.listdir(ctrlr.config["processed_dir"]):
+				os.rename(ctrlr.config["processed_dir"] + "/" + filename, incoming_dir + "/" + filename)
+			return ()
+		def create_document():
+			ctrlr.create_document(incoming_files, tags = [ "benchmark" ], attributes = { "peer": "Benchmark", "docname": "Synthetic" })
+		self._measure("create_document", create_document, setup = setup_create)
+		setup_create()
+
+	def _bench_doctool(self, library_dir):
+		doctool = self._basedir + "/doctool"
+		def setup():
+			target_dir = self._fresh_dir("doctool")
+			for filename in sorted(os.listdir(library_dir))[:self._args.doctool_documents]:
+				if filename.endswith(".mud"):
+					shutil.copy(library_dir + "/" + filename, target_dir + "/" + filename)
+			return (target_dir, )
+
+		def enhance(target_dir):
+			subprocess.check_call([ doctool, "-e", "-r", target_dir ])
+		self._measure("doctool_enhance", enhance, setup = setup)
+
+		def create_pdf(target_dir):
+			subprocess.check_call([ doctool, "-p", "-f", "-r", target_dir ])
+		self._measure("doctool_pdf", create_pdf, setup = setup)
+
+	def run(self):
+		with tempfile.TemporaryDirectory(prefix = "bulkscan_bench_", dir = self._args.workdir) as workdir:
+			self._workdir = workdir
+			generator = self._generator()
+			self._log("Generating %d incoming scans of %d x %d pixels..." % (self._args.incoming, self._args.width, self._args.height))
+			incoming_dir = self._fresh_dir("incoming")
+			incoming_files = generator.generate_incoming(incoming_dir, batches = 1, pages_per_batch = self._args.incoming)
+			self._log("Generating library of %d documents with %d pages each..." % (self._args.documents, self._args.pages))
+			library_dir = self._fresh_dir("library")
+			generator.generate_library(library_dir, documents = self._args.documents, pages_per_document = self._args.pages, derivatives_per_page = self._args.derivatives, properties_per_page = self._args.properties)
+
+			self._bench_multidoc(incoming_dir, incoming_files)
+			self._bench_library(library_dir)
+			if not self._args.no_doctool:
+				self._bench_doctool(library_dir)
+			# Last, since creating documents adds them to the library
+			self._bench_controller(incoming_dir, incoming_files)
+
+		return {
+			"meta": {
+				"timestamp_utc":	datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+				"hostname":			platform.node(),
+				"python":			platform.python_version(),
+				"cpus":				os.cpu_count(),
+				"parameters": {
+					"width":				self._args.width,
+					"height":				self._args.height,
+					"resolution":			self._args.resolution,
+					"incoming":				self._args.incoming,
+					"documents":			self._args.documents,
+					"pages":				self._args.pages,
+					"derivatives":			self._args.derivatives,
+					"properties":			self._args.properties,
+					"repeat":				self._args.repeat,
+					"seed":					self._args.seed,
+				},
+			},
+			"results": self._results,
+		}
+
+	@staticmethod
+	def compare(old_results, new_results, threshold = 0.1):
+		regressions = 0
+		for name in sorted(set(old_results["results"]) | set(new_results["results"])):
+			old = old_results["results"].get(name)
+			new = new_results["results"].get(name)
+			if (old is None) or (new is None):
+				print("%-32s only present in %s run" % (name, "new" if (old is None) else "old"))
+				continue
+			ratio = new["median"] / old["median"] if (old["median"] > 0) else float("inf")
+			if ratio > 1 + threshold:
+				verdict = "REGRESSION"
+				regressions += 1
+			elif ratio < 1 - threshold:
+				verdict = "improvement"
+			else:
+				verdict = ""
+			print("%-32s %8.3f -> %8.3f sec  %6.1f%%  %s" % (name, old["median"], new["median"], (ratio - 1) * 100, verdict))
+		return regressions
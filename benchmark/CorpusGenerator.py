@@ -0,0 +1,146 @@
+#	bulkscan - Document scanning and maintenance solution
+#	Copyright (C) 2019-2023 Johannes Bauer
+#
+#	This file is part of bulkscan.
+#
+#	bulkscan is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	bulkscan is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with bulkscan; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import uuid
+import zlib
+import struct
+import random
+import datetime
+import contextlib
+import doclib
+
+class SyntheticScan():
+	def __init__(self, width, height, resolution_dpi, seed = 0):
+		self._width = width
+		self._height = height
+		self._resolution_dpi = resolution_dpi
+		self._random = random.Random(seed)
+
+	def _text_row(self):
+		# Random runs of dark and light pixels that compress roughly like
+		# printed text does
+		row = bytearray(b"\xff" * self._width)
+		margin = self._width // 10
+		x = margin
+		while x < self._width - margin:
+			run = self._random.randint(2, 12)
+			if self._random.random() < 0.4:
+				row[x : x + run] = bytes(self._random.randint(0, 80) for i in range(run))
+			x += run
+		return bytes(row)
+
+	def _rows(self):
+		blank_row = b"\xff" * self._width
+		text_rows = [ self._text_row() for i in range(64) ]
+		line_height = max(self._resolution_dpi // 6, 8)
+		for y in range(self._height):
+			in_text = (y > self._height // 12) and (y < self._height * 11 // 12) and ((y % line_height) < (line_height * 2 // 3))
+			if in_text:
+				yield b"\x00" + self._random.choice(text_rows)
+			else:
+				yield b"\x00" + blank_row
+
+	@staticmethod
+	def _chunk(chunk_type, data):
+		return struct.pack(">L4s", len(data), chunk_type) + data + struct.pack(">L", zlib.crc32(chunk_type + data))
+
+	def write_png(self, filename, comment = None):
+		pixels_per_meter = round(self._resolution_dpi / 0.0254)
+		compressor = zlib.compressobj(6)
+		image_data = b"".join(compressor.compress(row) for row in self._rows()) + compressor.flush()
+		with open(filename, "wb") as f:
+			f.write(bytes.fromhex("89 50 4e 47 0d 0a 1a 0a"))
+			f.write(self._chunk(b"IHDR", struct.pack(">LLBBBBB", self._width, self._height, 8, 0, 0, 0, 0)))
+			f.write(self._chunk(b"pHYs", struct.pack(">LLB", pixels_per_meter, pixels_per_meter, 1)))
+			if comment is not None:
+				f.write(self._chunk(b"tEXt", b"comment\x00" + comment.encode("latin1")))
+			f.write(self._chunk(b"IDAT", image_data))
+			f.write(self._chunk(b"IEND", b""))
+
+class CorpusGenerator():
+	def __init__(self, width = 2480, height = 3508, resolution_dpi = 300, seed = 0):
+		self._width = width
+		self._height = height
+		self._resolution_dpi = resolution_dpi
+		self._random = random.Random(seed)
+
+	def _scan(self):
+		return SyntheticScan(self._width, self._height, self._resolution_dpi, seed = self._random.getrandbits(32))
+
+	def generate_incoming(self, directory, batches, pages_per_batch, first_scan_id = 1):
+		with contextlib.suppress(FileExistsError):
+			os.makedirs(directory)
+		filenames = [ ]
+		scan_id = first_scan_id
+		created_utc = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+		for batch in range(batches):
+			batch_uuid = str(uuid.uuid4())
+			for pageno in range(1, pages_per_batch + 1):
+				if (pageno % 2) == 1:
+					page_uuid = str(uuid.uuid4())
+				meta = {
+					"batch_uuid":		batch_uuid,
+					"created_utc":		created_utc,
+					"resolution":		self._resolution_dpi,
+					"mode":				"gray",
+					"page_uuid":		page_uuid,
+					"side":				"front" if ((pageno % 2) == 1) else "back",
+					"side_uuid":		str(uuid.uuid4()),
+					"scanned_page_no":	pageno,
+				}
+				filename = "bulk_%05d_%05d.png" % (scan_id, pageno)
+				self._scan().write_png(directory + "/" + filename, comment = json.dumps(meta))
+				filenames.append(filename)
+				scan_id += 1
+		return filenames
+
+	def generate_library(self, directory, documents, pages_per_document, derivatives_per_page = 0, properties_per_page = 2):
+		with contextlib.suppress(FileExistsError):
+			os.makedirs(directory)
+		page_filename = directory + "/.page.png"
+		self._scan().write_png(page_filename)
+		derivative_filename = directory + "/.derivative.png"
+		SyntheticScan(self._width // 4, self._height // 4, self._resolution_dpi // 4).write_png(derivative_filename)
+		with open(derivative_filename, "rb") as f:
+			derivative_data = f.read()
+
+		filenames = [ ]
+		for docno in range(documents):
+			filename = "%s/doc_%05d.mud" % (directory, docno)
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(filename)
+			with doclib.MultiDoc(filename) as doc:
+				for pageno in range(pages_per_document):
+					side_uuid = doc.add(page_filename, sheet_side = "front" if ((pageno % 2) == 0) else "back")
+					for propno in range(properties_per_page):
+						doc.set_side_property(side_uuid, "property_%02d" % (propno), str(uuid.uuid4()))
+					for derivno in range(derivatives_per_page):
+						doc.add_derivative(side_uuid, derivative_data, "enhanced")
+				doc.set_document_property("doc_uuid", str(uuid.uuid4()))
+				doc.set_document_property("peer", "Peer %d" % (docno % 17))
+				doc.set_document_property("docname", "Document %d" % (docno % 5))
+				doc.add_tag("tag%d" % (docno % 11))
+			filenames.append(filename)
+		os.unlink(page_filename)
+		os.unlink(derivative_filename)
+		return filenames
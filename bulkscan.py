@@ -30,20 +30,102 @@ import glob
 import re
 import queue
 import time
+import socket
+import shutil
 import threading
+import contextlib
+import doclib
 from Tools import Tools
 from FriendlyArgumentParser import FriendlyArgumentParser
 
+class BlankPageDetector():
+	def __init__(self, threshold = 128, max_coverage = 0.002, margin = 0.05):
+		self._threshold = threshold
+		self._max_coverage = max_coverage
+		self._margin = margin
+
+	@staticmethod
+	def _read_pnm_header(f):
+		fields = [ ]
+		while len(fields) < 4:
+			line = f.readline()
+			if len(line) == 0:
+				return None
+			fields += line.split(b"#", maxsplit = 1)[0].split()
+		(magic, width, height, maxval) = fields[:4]
+		return (magic, int(width), int(height), int(maxval))
+
+	def analyze(self, filename):
+		with open(filename, "rb") as f:
+			header = self._read_pnm_header(f)
+			if header is None:
+				return None
+			(magic, width, height, maxval) = header
+			if magic == b"P5":
+				channels = 1
+			elif magic == b"P6":
+				channels = 3
+			else:
+				return None
+			bytes_per_sample = 1 if (maxval < 256) else 2
+			data = f.read()
+
+		# Only the most significant byte of each sample is considered; ink
+		# pixels are all those darker than the threshold
+		threshold = self._threshold if (bytes_per_sample == 2) else (self._threshold * maxval // 255)
+		light_values = bytes(range(threshold, 256))
+		stride = width * channels * bytes_per_sample
+		margin_x = round(width * self._margin)
+		margin_y = round(height * self._margin)
+		row_start = margin_x * channels * bytes_per_sample
+		row_end = (width - margin_x) * channels * bytes_per_sample
+		data = memoryview(data)
+		ink_samples = 0
+		total_samples = 0
+		for y in range(margin_y, height - margin_y):
+			row = data[y * stride + row_start : y * stride + row_end]
+			if bytes_per_sample == 2:
+				row = row[0::2]
+			row = bytes(row)
+			ink_samples += len(row.translate(None, light_values))
+			total_samples += len(row)
+		if total_samples == 0:
+			return None
+		coverage = ink_samples / total_samples
+		return {
+			"blank":			coverage <= self._max_coverage,
+			"ink_coverage":		round(coverage, 6),
+			"threshold":		self._threshold,
+			"max_coverage":		self._max_coverage,
+			"margin":			self._margin,
+		}
+
 class ConversionJob():
-	def __init__(self, infile, outfile, meta = None):
+	def __init__(self, infile, outfile, meta = None, blank_detector = None, blank_action = "keep", remove_infile = True):
 		self._infile = infile
 		self._outfile = outfile
 		self._meta = meta
+		self._blank_detector = blank_detector
+		self._blank_action = blank_action
+		self._remove_infile = remove_infile
 
 	def start(self):
+		if self._blank_detector is not None:
+			with doclib.metrics.timed("blank_detection_duration_seconds"):
+				blank_page = self._blank_detector.analyze(self._infile)
+			if blank_page is not None:
+				blank_page["action"] = self._blank_action if blank_page["blank"] else "keep"
+				doclib.metrics.count("blank_detection_total", result = "blank" if blank_page["blank"] else "content", action = blank_page["action"])
+				if blank_page["action"] == "drop":
+					if self._remove_infile:
+						os.unlink(self._infile)
+					return
+				self._meta["blank_page"] = blank_page
+
 		jsonexif = json.dumps(self._meta)
-		subprocess.check_call([ "convert", "-units", "PixelsPerInch", "-density", str(self._meta["resolution"]), "-comment", jsonexif, self._infile, self._outfile ])
-		os.unlink(self._infile)
+		doclib.metrics.check_call([ "convert", "-units", "PixelsPerInch", "-density", str(self._meta["resolution"]), "-comment", jsonexif, self._infile, self._outfile ])
+		if self._remove_infile:
+			os.unlink(self._infile)
 
 	def __str__(self):
 		return "%s -> %s" % (self._infile, self._outfile)
@@ -73,6 +155,226 @@ class JobServer():
 				if self._quit:
 					break
 
+class SpoolClaim():
+	def __init__(self, spool, name, claim_filename):
+		self._spool = spool
+		self._name = name
+		self._claim_filename = claim_filename
+
+	@property
+	def name(self):
+		return self._name
+
+	@property
+	def claim_filename(self):
+		return self._claim_filename
+
+	@property
+	def raw_filename(self):
+		return self._spool.jobs_dir + "/" + self._name + ".pnm"
+
+	def read(self):
+		with open(self._claim_filename) as f:
+			return json.load(f)
+
+	def heartbeat(self):
+		with contextlib.suppress(FileNotFoundError):
+			os.utime(self._claim_filename)
+
+	# The claim filename contains the worker ID, so as long as it exists the
+	# job still belongs to this worker. If it is gone, the claim was considered
+	# stale and the job requeued; the raw image then belongs to whoever
+	# processes it next and must not be touched.
+	def complete(self):
+		try:
+			os.unlink(self._claim_filename)
+		except FileNotFoundError:
+			return False
+		with contextlib.suppress(FileNotFoundError):
+			os.unlink(self.raw_filename)
+		return True
+
+	def fail(self):
+		try:
+			os.rename(self._claim_filename, self._spool.failed_dir + "/" + self._name + ".json")
+		except FileNotFoundError:
+			return False
+		with contextlib.suppress(FileNotFoundError):
+			os.rename(self.raw_filename, self._spool.failed_dir + "/" + self._name + ".pnm")
+		return True
+
+class Spool():
+	# A job consists of a raw image "jobs/<name>.pnm" and a job description
+	# "jobs/<name>.json". The description is published last, so a job is only
+	# visible once it is complete. Workers claim jobs by atomically renaming
+	# the description into "claimed/" and keep the mtime of the claim fresh
+	# while they work; claims with outdated mtime belong to crashed workers.
+	def __init__(self, spool_dir, stale_timeout = 300):
+		self._spool_dir = spool_dir
+		self._stale_timeout = stale_timeout
+		for dirname in [ self.jobs_dir, self.claimed_dir, self.failed_dir ]:
+			with contextlib.suppress(FileExistsError):
+				os.makedirs(dirname)
+
+	@property
+	def jobs_dir(self):
+		return self._spool_dir + "/jobs"
+
+	@property
+	def claimed_dir(self):
+		return self._spool_dir + "/claimed"
+
+	@property
+	def failed_dir(self):
+		return self._spool_dir + "/failed"
+
+	def job_names(self):
+		names = set()
+		for dirname in [ self.jobs_dir, self.claimed_dir ]:
+			for filename in os.listdir(dirname):
+				if filename.endswith(".json"):
+					names.add(filename.split("@")[0].split(".")[0])
+		return names
+
+	def submit(self, name, infile, job_data):
+		raw_filename = self.jobs_dir + "/" + name + ".pnm"
+		shutil.move(infile, raw_filename + "_")
+		os.rename(raw_filename + "_", raw_filename)
+		with open(self.jobs_dir + "/." + name + ".json_", "w") as f:
+			json.dump(job_data, f)
+		os.rename(self.jobs_dir + "/." + name + ".json_", self.jobs_dir + "/" + name + ".json")
+
+	def claim(self, worker_id):
+		for filename in sorted(os.listdir(self.jobs_dir)):
+			if filename.startswith(".") or (not filename.endswith(".json")):
+				continue
+			name = filename[:-5]
+			claim_filename = "%s/%s@%s.json" % (self.claimed_dir, name, worker_id)
+			try:
+				os.rename(self.jobs_dir + "/" + filename, claim_filename)
+			except FileNotFoundError:
+				# Some other worker was faster
+				continue
+			claim = SpoolClaim(self, name, claim_filename)
+			claim.heartbeat()
+			return claim
+		return None
+
+	def recover_stale(self):
+		recovered = 0
+		now = time.time()
+		for filename in os.listdir(self.claimed_dir):
+			if not filename.endswith(".json"):
+				continue
+			claim_filename = self.claimed_dir + "/" + filename
+			try:
+				if now - os.stat(claim_filename).st_mtime < self._stale_timeout:
+					continue
+				os.rename(claim_filename, self.jobs_dir + "/" + filename.split("@")[0] + ".json")
+				recovered += 1
+			except FileNotFoundError:
+				pass
+		return recovered
+
+class SpoolWorker():
+	def __init__(self, args):
+		self._args = args
+		self._spool = Spool(self._args.spool_dir, stale_timeout = self._args.stale_timeout)
+		self._blank_detector = create_blank_detector(self._args)
+		self._worker_id = "%s-%d" % (socket.gethostname(), os.getpid())
+		self._claims = set()
+		self._claims_lock = threading.Lock()
+		self._quit = threading.Event()
+		with contextlib.suppress(FileExistsError):
+			os.makedirs(self._args.outdir)
+
+	def _heartbeat_thread(self):
+		while not self._quit.wait(self._args.stale_timeout / 4):
+			with self._claims_lock:
+				claims = list(self._claims)
+			for claim in claims:
+				claim.heartbeat()
+
+	def _process(self, claim, job_data, outfile):
+		if os.path.exists(outfile):
+			# Already published by a worker whose claim went stale
+			return
+		# Converted into a temporary file first so that the incoming
+		# directory never shows partially written images. The raw image is
+		# only removed once the claim is completed, i.e. after publishing.
+		tmpfile = self._args.outdir + "/." + job_data["outfile"] + "." + self._worker_id + "_"
+		job = ConversionJob(infile = claim.raw_filename, outfile = tmpfile, meta = job_data["meta"], blank_detector = self._blank_detector, blank_action = self._args.blank_action, remove_infile = False)
+		try:
+			job.start()
+			if os.path.exists(tmpfile):
+				os.rename(tmpfile, outfile)
+		finally:
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(tmpfile)
+
+	def _worker_thread(self, thread_no):
+		worker_id = "%s.%d" % (self._worker_id, thread_no)
+		while not self._quit.is_set():
+			self._spool.recover_stale()
+			claim = self._spool.claim(worker_id)
+			if claim is None:
+				if self._args.exit_when_idle:
+					break
+				self._quit.wait(1)
+				continue
+
+			with self._claims_lock:
+				self._claims.add(claim)
+			try:
+				outfile = None
+				try:
+					job_data = claim.read()
+					outfile = self._args.outdir + "/" + job_data["outfile"]
+					self._process(claim, job_data, outfile)
+					result = "success"
+				except (OSError, ValueError, KeyError, subprocess.CalledProcessError) as e:
+					if (outfile is not None) and os.path.exists(outfile):
+						# Output was published regardless, e.g. by another worker
+						# that had the same job requeued to it
+						result = "success"
+					else:
+						print("%s: conversion of %s failed: %s" % (worker_id, claim.name, str(e)), file = sys.stderr)
+						result = "failed"
+				if result == "success":
+					claim_held = claim.complete()
+				else:
+					claim_held = claim.fail()
+				if not claim_held:
+					print("%s: claim of %s was lost to stale job recovery" % (worker_id, claim.name), file = sys.stderr)
+					result = "lost"
+				doclib.metrics.count("spool_jobs_total", result = result)
+			finally:
+				with self._claims_lock:
+					self._claims.discard(claim)
+
+	def run(self):
+		heartbeat = threading.Thread(target = self._heartbeat_thread, daemon = True)
+		heartbeat.start()
+		threads = [ threading.Thread(target = self._worker_thread, args = (thread_no, )) for thread_no in range(self._args.worker_threads) ]
+		for thread in threads:
+			thread.start()
+		try:
+			for thread in threads:
+				thread.join()
+		except KeyboardInterrupt:
+			self._quit.set()
+			for thread in threads:
+				thread.join()
+		self._quit.set()
+		if self._args.metrics_file is not None:
+			with open(self._args.metrics_file, "w") as f:
+				f.write(doclib.metrics.to_prometheus())
+
+def create_blank_detector(args):
+	if args.blank_action == "off":
+		return None
+	return BlankPageDetector(threshold = args.blank_threshold, max_coverage = args.blank_coverage / 100, margin = args.blank_margin / 100)
+
 class BatchScanner():
 	def __init__(self, args):
 		self._args = args
@@ -91,13 +393,24 @@ class BatchScanner():
 				match = match.groupdict()
 				self._scan_id = max(self._scan_id, int(match["id"]))
 
-		self._jobserver = JobServer(concurrent_jobs = 12)
+		if self._args.spool_dir is not None:
+			# Conversion is left to spool workers, possibly on other hosts
+			self._spool = Spool(self._args.spool_dir, stale_timeout = self._args.stale_timeout)
+			self._jobserver = None
+			for name in self._spool.job_names():
+				match = regex.match(name)
+				if match:
+					self._scan_id = max(self._scan_id, int(match.groupdict()["id"]))
+		else:
+			self._spool = None
+			self._jobserver = JobServer(concurrent_jobs = 12)
+		self._blank_detector = create_blank_detector(self._args)
 
 	def scan_next_batch(self):
 		batch_uuid = str(uuid.uuid4())
 
 		scan_cmd = [ "scanimage", "--mode", self._args.mode, "--resolution", str(self._args.resolution), "--batch=" + self._args.tempdir + "/scan_" + batch_uuid + "_%05d.pnm" ] + self._config["scan_cmdline"]
-		subprocess.call(scan_cmd)
+		doclib.metrics.call(scan_cmd)
 		infiles = [ ]
 		regex = re.compile("scan_" + batch_uuid + "_(?P<no>\d{5}).pnm")
 		for filename in glob.glob(self._args.tempdir + "/scan_" + batch_uuid + "_?????.pnm"):
@@ -110,14 +423,18 @@ class BatchScanner():
 		now = datetime.datetime.utcnow()
 		for (pageno, infile) in infiles:
 			self._scan_id += 1
-			outfile = self._args.outdir + "/bulk_%05d_%05d.png" % (self._scan_id, pageno)
-			job = ConversionJob(infile = infile, outfile = outfile, meta = {
+			name = "bulk_%05d_%05d" % (self._scan_id, pageno)
+			meta = {
 				"batch_uuid":		batch_uuid,
 				"created_utc":		now.strftime("%Y-%m-%dT%H:%M:%SZ"),
 				"resolution":		self._args.resolution,
 				"mode":				self._args.mode,
-			})
-			self._jobserver.add(job)
+			}
+			if self._spool is not None:
+				self._spool.submit(name, infile, { "outfile": name + ".png", "meta": meta })
+			else:
+				job = ConversionJob(infile = infile, outfile = self._args.outdir + "/" + name + ".png", meta = meta, blank_detector = self._blank_detector, blank_action = self._args.blank_action)
+				self._jobserver.add(job)
 
 	def run(self):
 		while True:
@@ -126,15 +443,36 @@ class BatchScanner():
 			if result == "q":
 				break
 			self.scan_next_batch()
-		self._jobserver.shutdown()
+		if self._jobserver is not None:
+			self._jobserver.shutdown()
+		if self._args.metrics_file is not None:
+			with open(self._args.metrics_file, "w") as f:
+				f.write(doclib.metrics.to_prometheus())
 
 parser = FriendlyArgumentParser()
 parser.add_argument("-c", "--config-file", metavar = "filename", type = str, default = "config.json", help = "Configuration file to read. Defaults to %(default)s.")
 parser.add_argument("-o", "--outdir", metavar = "dirname", type = str, default = "output/", help = "Output directory to place files in. Defaults to %(default)s.")
 parser.add_argument("-r", "--resolution", metavar = "dpi", type = int, default = 300, help = "Resolution to use in dots per inch, defaults to %(default)d dpi.")
 parser.add_argument("-m", "--mode", choices = [ "gray" ], default = "gray", help = "Scan mode to use. Can be one of %(choices)s, defaults to %(default)s.")
+parser.add_argument("--blank-action", choices = [ "off", "tag", "drop" ], default = "tag", help = "What to do with pages that are detected as blank. \"off\" disables detection entirely, \"tag\" records the result in the metadata of the page and \"drop\" discards blank pages. Can be one of %(choices)s, defaults to %(default)s.")
+parser.add_argument("--blank-threshold", metavar = "value", type = int, default = 128, help = "Gray value (0-255) below which a pixel counts as ink for blank page detection. Defaults to %(default)d.")
+parser.add_argument("--blank-coverage", metavar = "percent", type = float, default = 0.2, help = "Maximum percentage of ink pixels for which a page is still considered blank. Defaults to %(default).1f%%.")
+parser.add_argument("--blank-margin", metavar = "percent", type = float, default = 5, help = "Percentage of width and height on each edge that is ignored for blank page detection, to skip shadows and punch holes. Defaults to %(default).0f%%.")
+parser.add_argument("-s", "--spool-dir", metavar = "dirname", type = str, help = "Do not convert scanned images in this process, but place them as jobs into this spool directory. It may be shared between hosts, e.g., via NFS. Jobs are then processed by one or more instances started with --worker.")
+parser.add_argument("-w", "--worker", action = "store_true", help = "Do not scan, but run as a conversion worker that processes jobs from the spool directory and places the results in the output directory.")
+parser.add_argument("--worker-threads", metavar = "count", type = int, default = os.cpu_count(), help = "Number of concurrent conversions in worker mode. Defaults to %(default)d.")
+parser.add_argument("--stale-timeout", metavar = "secs", type = float, default = 300, help = "Jobs claimed by a worker that has not shown signs of life for this duration are considered abandoned and given to another worker. Defaults to %(default).0f seconds.")
+parser.add_argument("--exit-when-idle", action = "store_true", help = "In worker mode, terminate as soon as the spool directory contains no more jobs instead of waiting for new ones.")
+parser.add_argument("--metrics-file", metavar = "filename", type = str, help = "When quitting, write timing metrics of all scanner and conversion invocations to this file in Prometheus text format.")
 parser.add_argument("-t", "--tempdir", metavar = "dirname", type = str, default = "/tmp", help = "Temporary directory to keep raw files. Defaults to %(default)s")
 args = parser.parse_args(sys.argv[1:])
 
-scanner = BatchScanner(args)
-scanner.run()
+if args.worker:
+	if args.spool_dir is None:
+		print("Worker mode requires a spool directory.", file = sys.stderr)
+		sys.exit(1)
+	worker = SpoolWorker(args)
+	worker.run()
+else:
+	scanner = BatchScanner(args)
+	scanner.run()
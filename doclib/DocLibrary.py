@@ -21,7 +21,8 @@
 
 import os
 import uuid
-from doclib import MultiDoc
+import threading
+from doclib import MultiDoc, PageHashIndex
 
 class DocumentException(Exception): pass
 class DuplicateDocumentException(DocumentException): pass
@@ -33,6 +34,7 @@ class DocEntry():
 			"filename":		mudfile,
 		}
 		self._stats["mtime"] = self.mudfile_mtime
+		self._page_hashes = None
 		self._stats["data"] = self._get_stats()
 
 	@property
@@ -47,48 +49,149 @@ class DocEntry():
 	def mudfile_mtime(self):
 		return os.stat(self.filename).st_mtime
 
+	@property
+	def page_hashes(self):
+		return self._page_hashes
+
 	@property
 	def metadata(self):
 		return self._stats["data"]
 
+	@property
+	def modified(self):
+		return self.mudfile_mtime != self._stats["mtime"]
+
 	def _get_stats(self):
 		stats = { }
 		with MultiDoc(self.filename) as doc:
 			stats["properties"] = doc.get_document_properties()
 			stats["tags"] = sorted(doc.tags)
 			stats["pages"] = doc.get_all_page_properties()
+			self._page_hashes = doc.get_page_hashes()
 		return stats
 
 class DocLibrary():
 	def __init__(self, cachefile = None):
 		self._cachefile = cachefile
 		self._documents = { }
+		self._uuid_by_filename = { }
+		self._directories = set()
+		self._rejected = { }
+		self._listeners = [ ]
+		self._hash_index = PageHashIndex()
+		self._lock = threading.RLock()
 
 	@property
 	def doc_dict(self):
 		return self._documents
 
-	def add_document(self, filename):
-		entry = DocEntry(filename)
+	def add_listener(self, callback):
+		# Callback is invoked as callback(event, old_entry, new_entry), where
+		# event is one of "add", "change" or "delete".
+		with self._lock:
+			self._listeners.append(callback)
+
+	def _notify(self, event, old_entry, new_entry):
+		for listener in self._listeners:
+			listener(event, old_entry, new_entry)
+
+	def _insert(self, entry):
 		if entry.doc_uuid is None:
-			raise DocumentWithoutUUIDException("%s: no document UUID present" % (filename))
+			raise DocumentWithoutUUIDException("%s: no document UUID present" % (entry.filename))
 		if entry.doc_uuid in self._documents:
-			raise DuplicateDocumentException("%s: %s already present in library as %s" % (entry.doc_uuid, filename, self._documents[entry.doc_uuid].filename))
+			raise DuplicateDocumentException("%s: %s already present in library as %s" % (entry.doc_uuid, entry.filename, self._documents[entry.doc_uuid].filename))
 		self._documents[entry.doc_uuid] = entry
+		self._uuid_by_filename[entry.filename] = entry.doc_uuid
+		self._hash_index.add(entry.doc_uuid, entry.page_hashes)
+
+	def _remove(self, filename):
+		doc_uuid = self._uuid_by_filename.pop(filename)
+		self._hash_index.remove(doc_uuid)
+		return self._documents.pop(doc_uuid)
+
+	def find_page(self, img_hash):
+		with self._lock:
+			return [ (self._documents[doc_uuid], side_uuid) for (doc_uuid, side_uuid) in sorted(self._hash_index.lookup(img_hash)) ]
+
+	def duplicate_pages(self):
+		with self._lock:
+			return self._hash_index.duplicate_pages()
+
+	def duplicate_documents(self):
+		with self._lock:
+			return self._hash_index.duplicate_documents()
+
+	def add_document(self, filename):
+		entry = DocEntry(os.path.normpath(filename))
+		with self._lock:
+			self._insert(entry)
+			self._notify("add", None, entry)
 		return entry
 
-	def add_directory(self, dirname, errors = "ignore"):
-		assert(errors in [ "ignore", "throw" ])
-		if not dirname.endswith("/"):
-			dirname += "/"
+	def remove_document(self, filename):
+		filename = os.path.normpath(filename)
+		with self._lock:
+			if filename not in self._uuid_by_filename:
+				return None
+			entry = self._remove(filename)
+			self._notify("delete", entry, None)
+		return entry
+
+	def refresh_document(self, filename):
+		filename = os.path.normpath(filename)
+		with self._lock:
+			if filename not in self._uuid_by_filename:
+				return self.add_document(filename)
+			old_entry = self._documents[self._uuid_by_filename[filename]]
+			if not os.path.isfile(filename):
+				return self.remove_document(filename)
+			if not old_entry.modified:
+				return old_entry
+			new_entry = DocEntry(filename)
+			self._remove(filename)
+			try:
+				self._insert(new_entry)
+			except DocumentException:
+				self._notify("delete", old_entry, None)
+				raise
+			self._notify("change", old_entry, new_entry)
+		return new_entry
+
+	def _scan_directory(self, dirname, errors):
+		present = set()
 		for filename in os.listdir(dirname):
 			if filename.endswith(".mud"):
-				full_filename = dirname + filename
+				full_filename = os.path.normpath(dirname + filename)
+				present.add(full_filename)
+				if (errors == "ignore") and (self._rejected.get(full_filename) == os.stat(full_filename).st_mtime):
+					# Unchanged since it was last rejected, do not reopen
+					continue
 				try:
-					self.add_document(full_filename)
+					self.refresh_document(full_filename)
 				except DocumentException:
+					self._rejected[full_filename] = os.stat(full_filename).st_mtime
 					if errors == "throw":
 						raise
+		return present
+
+	def add_directory(self, dirname, errors = "ignore"):
+		assert(errors in [ "ignore", "throw" ])
+		if not dirname.endswith("/"):
+			dirname += "/"
+		with self._lock:
+			self._directories.add(os.path.normpath(dirname))
+			self._scan_directory(dirname, errors)
+
+	def rescan(self, errors = "ignore"):
+		assert(errors in [ "ignore", "throw" ])
+		with self._lock:
+			present = set()
+			for dirname in self._directories:
+				present |= self._scan_directory(dirname + "/", errors)
+			for filename in list(self._uuid_by_filename):
+				if (os.path.dirname(filename) in self._directories) and (filename not in present):
+					self.remove_document(filename)
 
 	def __iter__(self):
-		return iter(self._documents.items())
+		with self._lock:
+			return iter(list(self._documents.items()))
@@ -22,6 +22,8 @@
 import os
 import json
 import subprocess
+from .PNGReader import PNGReader, PNGReaderException
+from .Metrics import metrics
 
 class MetaReaderException(Exception): pass
 
@@ -29,13 +31,27 @@ class MetaReader():
 	def __init__(self, filename):
 		self._filename = filename
 
-	def read(self):
-		if not os.path.isfile(self._filename):
-			raise FileNotFoundError(self._filename)
-		comment = subprocess.check_output([ "exiftool", "-S", "-comment", self._filename ])
+	def _read_comment_exiftool(self):
+		comment = metrics.check_output([ "exiftool", "-S", "-comment", self._filename ])
 		comment = comment.decode("utf-8")
 		comment = comment.rstrip("\r\n")
 		comment = comment[9:]
+		return comment
+
+	def _read_comment(self):
+		if self._filename.lower().endswith(".png"):
+			# Fast path: parse the text chunks directly instead of forking
+			# exiftool for every file
+			try:
+				return PNGReader(self._filename).read_comment() or ""
+			except PNGReaderException:
+				pass
+		return self._read_comment_exiftool()
+
+	def read(self):
+		if not os.path.isfile(self._filename):
+			raise FileNotFoundError(self._filename)
+		comment = self._read_comment()
 		try:
 			data = json.loads(comment)
 		except json.JSONDecodeError as e:
@@ -44,4 +60,4 @@ class MetaReader():
 
 	def write(self, data):
 		jsondata = json.dumps(data)
-		subprocess.check_call([ "exiftool", "-overwrite_original_in_place", "-comment=%s" % (jsondata), self._filename ], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+		metrics.check_call([ "exiftool", "-overwrite_original_in_place", "-comment=%s" % (jsondata), self._filename ], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
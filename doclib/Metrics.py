@@ -0,0 +1,170 @@
+#	bulkscan - Document scanning and maintenance solution
+#	Copyright (C) 2019-2023 Johannes Bauer
+#
+#	This file is part of bulkscan.
+#
+#	bulkscan is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	bulkscan is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with bulkscan; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import time
+import bisect
+import threading
+import subprocess
+import contextlib
+
+class Histogram():
+	_DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+	def __init__(self, buckets = None):
+		self._buckets = buckets or self._DEFAULT_BUCKETS
+		self._counts = [ 0 ] * (len(self._buckets) + 1)
+		self._sum = 0
+		self._count = 0
+
+	def observe(self, value):
+		self._counts[bisect.bisect_left(self._buckets, value)] += 1
+		self._sum += value
+		self._count += 1
+
+	def cumulative_buckets(self):
+		total = 0
+		for (upper_bound, count) in zip(self._buckets + (float("inf"), ), self._counts):
+			total += count
+			yield (upper_bound, total)
+
+	def to_dict(self):
+		return {
+			"count":	self._count,
+			"sum":		self._sum,
+			"buckets":	{ ("+Inf" if (upper_bound == float("inf")) else str(upper_bound)): count for (upper_bound, count) in self.cumulative_buckets() },
+		}
+
+class TimedCursor():
+	def __init__(self, metrics, cursor):
+		self._metrics = metrics
+		self._cursor = cursor
+
+	def execute(self, sql, parameters = ()):
+		operation = sql.lstrip().split(maxsplit = 1)[0].upper()
+		with self._metrics.timed("sqlite_query_duration_seconds", operation = operation):
+			self._cursor.execute(sql, parameters)
+		return self
+
+	def __getattr__(self, name):
+		return getattr(self._cursor, name)
+
+class Metrics():
+	def __init__(self, prefix = "bulkscan"):
+		self._prefix = prefix
+		self._lock = threading.Lock()
+		self._histograms = { }
+		self._counters = { }
+
+	@staticmethod
+	def _key(name, labels):
+		return (name, tuple(sorted(labels.items())))
+
+	def observe(self, name, value, **labels):
+		key = self._key(name, labels)
+		with self._lock:
+			if key not in self._histograms:
+				self._histograms[key] = Histogram()
+			self._histograms[key].observe(value)
+
+	def count(self, name, amount = 1, **labels):
+		key = self._key(name, labels)
+		with self._lock:
+			self._counters[key] = self._counters.get(key, 0) + amount
+
+	@contextlib.contextmanager
+	def timed(self, name, **labels):
+		t0 = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(name, time.perf_counter() - t0, **labels)
+
+	def cache_access(self, cache, hit):
+		self.count("cache_requests_total", cache = cache, result = "hit" if hit else "miss")
+
+	def _run_tool(self, subprocess_fnc, cmd, **kwargs):
+		tool = os.path.basename(cmd[0])
+		input_data = kwargs.get("input")
+		if input_data is not None:
+			self.count("tool_bytes_total", len(input_data), tool = tool, direction = "in")
+		with self.timed("tool_duration_seconds", tool = tool):
+			result = subprocess_fnc(cmd, **kwargs)
+		if isinstance(result, bytes):
+			self.count("tool_bytes_total", len(result), tool = tool, direction = "out")
+		return result
+
+	def check_output(self, cmd, **kwargs):
+		return self._run_tool(subprocess.check_output, cmd, **kwargs)
+
+	def check_call(self, cmd, **kwargs):
+		return self._run_tool(subprocess.check_call, cmd, **kwargs)
+
+	def call(self, cmd, **kwargs):
+		return self._run_tool(subprocess.call, cmd, **kwargs)
+
+	def cursor(self, cursor):
+		return TimedCursor(self, cursor)
+
+	def to_dict(self):
+		result = { "counters": [ ], "histograms": [ ] }
+		with self._lock:
+			for ((name, labels), value) in sorted(self._counters.items()):
+				result["counters"].append({ "name": name, "labels": dict(labels), "value": value })
+			for ((name, labels), histogram) in sorted(self._histograms.items(), key = lambda item: item[0]):
+				result["histograms"].append(dict(histogram.to_dict(), name = name, labels = dict(labels)))
+		return result
+
+	@staticmethod
+	def _format_labels(labels, extra_labels = None):
+		labels = list(labels) + list(extra_labels or [ ])
+		if len(labels) == 0:
+			return ""
+		escape = lambda value: str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+		return "{" + ",".join("%s=\"%s\"" % (key, escape(value)) for (key, value) in labels) + "}"
+
+	def to_prometheus(self):
+		lines = [ ]
+		with self._lock:
+			counter_names = sorted(set(name for (name, labels) in self._counters))
+			for name in counter_names:
+				full_name = "%s_%s" % (self._prefix, name)
+				lines.append("# TYPE %s counter" % (full_name))
+				for ((counter_name, labels), value) in sorted(self._counters.items()):
+					if counter_name == name:
+						lines.append("%s%s %s" % (full_name, self._format_labels(labels), value))
+
+			histogram_names = sorted(set(name for (name, labels) in self._histograms))
+			for name in histogram_names:
+				full_name = "%s_%s" % (self._prefix, name)
+				lines.append("# TYPE %s histogram" % (full_name))
+				for ((histogram_name, labels), histogram) in sorted(self._histograms.items(), key = lambda item: item[0]):
+					if histogram_name != name:
+						continue
+					for (upper_bound, count) in histogram.cumulative_buckets():
+						le = "+Inf" if (upper_bound == float("inf")) else str(upper_bound)
+						lines.append("%s_bucket%s %d" % (full_name, self._format_labels(labels, [ ("le", le) ]), count))
+					histogram_data = histogram.to_dict()
+					lines.append("%s_sum%s %f" % (full_name, self._format_labels(labels), histogram_data["sum"]))
+					lines.append("%s_count%s %d" % (full_name, self._format_labels(labels), histogram_data["count"]))
+		return "\n".join(lines) + "\n"
+
+metrics = Metrics()
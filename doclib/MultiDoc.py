@@ -20,6 +20,10 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import os
+import io
+import json
+import shutil
+import tempfile
 import sqlite3
 import contextlib
 import textwrap
@@ -28,15 +32,31 @@ import uuid
 import subprocess
 import collections
 import contextlib
+import threading
+from .Metrics import metrics
 
 class MultiDoc(object):
 	_ImageCollection = collections.namedtuple("ImageCollection", [ "original", "enhanced", "thumbs" ])
 	_ImageInfo = collections.namedtuple("ImageInfo", [ "datatype", "width", "height", "resolution_dpi" ])
 	_DerivativeInfo = collections.namedtuple("DerivativeInfo", [ "derivative_id", "image_info" ])
+	_THUMBNAIL_SIZES = collections.OrderedDict([
+		("screen",		(1600, 2263)),
+		("preview",		(600, 849)),
+		("grid",		(200, 283)),
+	])
+	_OriginalSize = collections.namedtuple("OriginalSize", [ "side_uuid", "datatype", "width", "height", "data_bytes" ])
+	_SpaceUsage = collections.namedtuple("SpaceUsage", [ "file_size", "page_size", "page_count", "free_bytes", "original_bytes", "derivative_bytes", "other_bytes" ])
 	def __init__(self, filename):
 		self._filename = filename
 		self._conn = sqlite3.connect(filename)
-		self._cursor = self._conn.cursor()
+		self._cursor = metrics.cursor(self._conn.cursor())
+
+		# Only set on newly created files, since setting it rewrites the
+		# header and thereby changes the mtime even of files that are only
+		# read. Existing ones need to be migrated explicitly through
+		# enable_incremental_vacuum()
+		if self._cursor.execute("PRAGMA page_count;").fetchone()[0] == 0:
+			self._cursor.execute("PRAGMA auto_vacuum = INCREMENTAL;")
 
 		with contextlib.suppress(sqlite3.OperationalError):
 			self._cursor.execute(textwrap.dedent("""\
@@ -113,7 +133,7 @@ class MultiDoc(object):
 	def _image_info(self, filename, input_data = None):
 		if input_data is not None:
 			filename = "-"
-		stdout = subprocess.check_output([ "identify", "-format", "%w %h %x %y %U %m", filename ], input = input_data)
+		stdout = metrics.check_output([ "identify", "-format", "%w %h %x %y %U %m", filename ], input = input_data)
 		stdout = stdout.decode("ascii").split()
 		(width, height, resolution_x, resolution_y, resolution_unit, datatype) = stdout
 		width = int(width)
@@ -158,21 +178,129 @@ class MultiDoc(object):
 		self._cursor.close()
 		self._conn.close()
 
-	def add_derivative(self, side_uuid, img_data, derivative_type):
-		info = self._image_info(filename = None, input_data = img_data)
+	def add_derivative(self, side_uuid, img_data, derivative_type, info = None):
+		if info is None:
+			info = self._image_info(filename = None, input_data = img_data)
+		metrics.count("sqlite_blob_bytes_total", len(img_data), direction = "write")
 		self._cursor.execute("""INSERT INTO image_derivative (derivative_id, side_uuid, derivative_type, data, datatype, width, height, resolution_dpi) VALUES
 				((SELECT MAX(derivative_id) + 1 FROM image_derivative), ?, ?, ?, ?, ?, ?, ?);""",
 				(side_uuid, derivative_type, img_data, info.datatype, info.width, info.height, info.resolution_dpi))
+		return self._cursor.lastrowid
+
+	@staticmethod
+	def _fit_into(width, height, box_width, box_height):
+		scale = min(box_width / width, box_height / height)
+		return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+	def _missing_thumbnails(self, side_info):
+		missing = [ ]
+		for (name, (box_width, box_height)) in self._THUMBNAIL_SIZES.items():
+			if (side_info.original.width <= box_width) and (side_info.original.height <= box_height):
+				# Never upscale, the original is small enough already
+				continue
+			(width, height) = self._fit_into(side_info.original.width, side_info.original.height, box_width, box_height)
+			if not any((abs(thumb.image_info.width - width) <= 1) and (abs(thumb.image_info.height - height) <= 1) for thumb in side_info.thumbs):
+				missing.append((name, width, height))
+		return missing
+
+	def add_thumbnails(self, side_uuid, img_data = None):
+		side_info = self.get_side_images_info(side_uuid)
+		missing = self._missing_thumbnails(side_info)
+		if len(missing) == 0:
+			return [ ]
+		if img_data is None:
+			img_data = self.get_page_image(side_uuid, allow_enhanced = False)
+
+		# All renditions are scaled from the same decoded original, kept in
+		# ImageMagick's memory register, so the original is decoded only once
+		# and every rendition is JPEG encoded exactly once
+		with tempfile.TemporaryDirectory(prefix = "mud_thumbs_") as tmpdir:
+			cmd = [ "convert", "-", "-write", "mpr:source", "+delete" ]
+			for (index, (name, width, height)) in enumerate(missing):
+				resolution_dpi = side_info.original.resolution_dpi * width / side_info.original.width
+				cmd += [ "mpr:source", "-thumbnail", "%dx%d!" % (width, height), "-units", "PixelsPerInch", "-density", "%.3f" % (resolution_dpi), "-quality", "85" ]
+				output = "jpeg:%s/%s.jpg" % (tmpdir, name)
+				if index == len(missing) - 1:
+					cmd += [ output ]
+				else:
+					cmd += [ "-write", output, "+delete" ]
+			metrics.check_call(cmd, input = img_data)
+
+			added = [ ]
+			for (name, width, height) in missing:
+				with open("%s/%s.jpg" % (tmpdir, name), "rb") as f:
+					thumb_data = f.read()
+				self.add_derivative(side_uuid, thumb_data, "thumb")
+				added.append(name)
+		return added
+
+	def get_ocr(self, side_uuid):
+		row = self._cursor.execute("SELECT data FROM image_derivative WHERE (side_uuid = ?) AND (derivative_type = 'ocr') ORDER BY derivative_id DESC LIMIT 1;", (side_uuid, )).fetchone()
+		if row is None:
+			return None
+		return json.loads(row[0].decode("utf-8"))
+
+	def set_ocr(self, side_uuid, ocr_result):
+		# Recognized text is not an image, dimensions are those of the image
+		# the word boxes refer to
+		self._cursor.execute("DELETE FROM image_derivative WHERE (side_uuid = ?) AND (derivative_type = 'ocr');", (side_uuid, ))
+		info = self._ImageInfo(datatype = "json", width = ocr_result.get("width"), height = ocr_result.get("height"), resolution_dpi = None)
+		return self.add_derivative(side_uuid, json.dumps(ocr_result, sort_keys = True).encode("utf-8"), "ocr", info = info)
 
 	def delete_all_derivatives(self):
 		self._cursor.execute("DELETE FROM image_derivative;")
 		self._conn.commit()
+		if self.auto_vacuum_mode == "incremental":
+			self.incremental_vacuum()
+		else:
+			self._cursor.execute("VACUUM;")
+
+	@property
+	def auto_vacuum_mode(self):
+		mode = self._cursor.execute("PRAGMA auto_vacuum;").fetchone()[0]
+		return {
+			0:	"none",
+			1:	"full",
+			2:	"incremental",
+		}[mode]
+
+	def enable_incremental_vacuum(self):
+		if self.auto_vacuum_mode == "incremental":
+			return False
+		self._conn.commit()
+		self._cursor.execute("PRAGMA auto_vacuum = INCREMENTAL;")
 		self._cursor.execute("VACUUM;")
+		return True
+
+	def incremental_vacuum(self, max_pages = None):
+		self._conn.commit()
+		free_pages_before = self._cursor.execute("PRAGMA freelist_count;").fetchone()[0]
+		# The pragma only frees one page per step and the sqlite3 module steps
+		# statements without result rows only once, so use executescript()
+		# which runs it to completion
+		if max_pages is None:
+			self._conn.executescript("PRAGMA incremental_vacuum;")
+		else:
+			self._conn.executescript("PRAGMA incremental_vacuum(%d);" % (max_pages))
+		free_pages_after = self._cursor.execute("PRAGMA freelist_count;").fetchone()[0]
+		page_size = self._cursor.execute("PRAGMA page_size;").fetchone()[0]
+		return (free_pages_before - free_pages_after) * page_size
+
+	def get_space_usage(self):
+		self._conn.commit()
+		page_size = self._cursor.execute("PRAGMA page_size;").fetchone()[0]
+		page_count = self._cursor.execute("PRAGMA page_count;").fetchone()[0]
+		free_bytes = self._cursor.execute("PRAGMA freelist_count;").fetchone()[0] * page_size
+		original_bytes = self._cursor.execute("SELECT IFNULL(SUM(LENGTH(data)), 0) FROM image_original;").fetchone()[0]
+		derivative_bytes = { derivative_type: size for (derivative_type, size) in self._cursor.execute("SELECT derivative_type, SUM(LENGTH(data)) FROM image_derivative GROUP BY derivative_type;").fetchall() }
+		other_bytes = max(0, page_count * page_size - free_bytes - original_bytes - sum(derivative_bytes.values()))
+		return self._SpaceUsage(file_size = os.stat(self.filename).st_size, page_size = page_size, page_count = page_count, free_bytes = free_bytes, original_bytes = original_bytes, derivative_bytes = derivative_bytes, other_bytes = other_bytes)
 
 	def add(self, filename, side_uuid = None, sheet_uuid = None, sheet_side = "front"):
 		with open(filename, "rb") as f:
 			data = f.read()
 		img_hash_sha256 = hashlib.sha256(data).hexdigest()
+		metrics.count("sqlite_blob_bytes_total", len(data), direction = "write")
 		info = self._image_info(filename)
 
 		if side_uuid is None:
@@ -185,6 +313,9 @@ class MultiDoc(object):
 
 		return side_uuid
 
+	def get_original_sizes(self):
+		return [ self._OriginalSize(*row) for row in self._cursor.execute("SELECT side_uuid, datatype, width, height, length(data) FROM image_original ORDER BY orderno ASC;").fetchall() ]
+
 	def get_side_images_info(self, side_uuid):
 		original_info = self._cursor.execute("SELECT datatype, width, height, resolution_dpi FROM image_original WHERE side_uuid = ?;", (side_uuid, )).fetchone()
 		if original_info is None:
@@ -200,11 +331,74 @@ class MultiDoc(object):
 			derivatives[derivative_type].append(derivative_info)
 		return self._ImageCollection(original = original_info, enhanced = derivatives["enhanced"], thumbs = derivatives["thumb"])
 
+	@staticmethod
+	def compute_pixel_hash(img_data):
+		# Hash of the decoded pixel data, independent of the file encoding.
+		# The decoded image is streamed through the hash function since it is
+		# many times the size of the encoded one.
+		hasher = hashlib.sha256()
+		with metrics.timed("tool_duration_seconds", tool = "convert"):
+			proc = subprocess.Popen([ "convert", "-", "-depth", "16", "rgba:-" ], stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+			def feed_input():
+				try:
+					proc.stdin.write(img_data)
+				except BrokenPipeError:
+					pass
+				finally:
+					proc.stdin.close()
+			feeder = threading.Thread(target = feed_input)
+			feeder.start()
+			while True:
+				chunk = proc.stdout.read(1024 * 1024)
+				if len(chunk) == 0:
+					break
+				hasher.update(chunk)
+			feeder.join()
+			returncode = proc.wait()
+		if returncode != 0:
+			raise subprocess.CalledProcessError(returncode, proc.args)
+		return hasher.hexdigest()
+
+	def get_side_property(self, side_uuid, key):
+		row = self._cursor.execute("SELECT value FROM image_meta WHERE (side_uuid = ?) AND (key = ?);", (side_uuid, key)).fetchone()
+		if row is None:
+			return None
+		else:
+			return row[0]
+
+	def get_page_hashes(self):
+		# All hashes under which the original image of each side is known,
+		# i.e., including the hash of the ingested file before recompression
+		page_hashes = { }
+		for (side_uuid, img_hash_sha256) in self._cursor.execute("SELECT side_uuid, img_hash_sha256 FROM image_original;").fetchall():
+			page_hashes[side_uuid] = set() if (img_hash_sha256 is None) else { img_hash_sha256 }
+		for (side_uuid, img_hash_sha256) in self._cursor.execute("SELECT side_uuid, value FROM image_meta WHERE key = 'orig_img_hash_sha256';").fetchall():
+			if side_uuid in page_hashes:
+				page_hashes[side_uuid].add(img_hash_sha256)
+		return page_hashes
+
+	def get_original_hash(self, side_uuid):
+		return self._cursor.execute("SELECT img_hash_sha256 FROM image_original WHERE side_uuid = ?;", (side_uuid, )).fetchone()[0]
+
+	def replace_original_image(self, side_uuid, img_data, pixel_hash_sha256):
+		# Only for a lossless re-encoding of the same image: the hash of the
+		# originally ingested file is retained as a side property
+		if self.get_side_property(side_uuid, "orig_img_hash_sha256") is None:
+			self.set_side_property(side_uuid, "orig_img_hash_sha256", self.get_original_hash(side_uuid))
+		self.set_side_property(side_uuid, "pixel_hash_sha256", pixel_hash_sha256)
+		img_hash_sha256 = hashlib.sha256(img_data).hexdigest()
+		metrics.count("sqlite_blob_bytes_total", len(img_data), direction = "write")
+		self._cursor.execute("UPDATE image_original SET data = ?, img_hash_sha256 = ? WHERE side_uuid = ?;", (img_data, img_hash_sha256, side_uuid))
+
 	def get_derived_image(self, derivative_id):
-		return self._cursor.execute("SELECT data FROM image_derivative WHERE derivative_id = ?;", (derivative_id, )).fetchone()[0]
+		data = self._cursor.execute("SELECT data FROM image_derivative WHERE derivative_id = ?;", (derivative_id, )).fetchone()[0]
+		metrics.count("sqlite_blob_bytes_total", len(data), direction = "read")
+		return data
 
 	def get_page_image(self, side_uuid, allow_enhanced = True):
-		return self._cursor.execute("SELECT data FROM image_original WHERE side_uuid = ?;", (side_uuid, )).fetchone()[0]
+		data = self._cursor.execute("SELECT data FROM image_original WHERE side_uuid = ?;", (side_uuid, )).fetchone()[0]
+		metrics.count("sqlite_blob_bytes_total", len(data), direction = "read")
+		return data
 
 	def get_page_order(self):
 		return [ row[0] for row in self._cursor.execute("SELECT side_uuid FROM image_original ORDER BY orderno ASC;").fetchall() ]
@@ -246,30 +440,186 @@ class MultiDoc(object):
 	def remove_tag(self, tag):
 		self._cursor.execute("DELETE FROM document_tags WHERE tag = ?;", (tag, ))
 
+	@contextlib.contextmanager
+	def _attached(self, filenames):
+		# ATTACH is not possible within a transaction, so all sources are
+		# attached first and everything imported from them is committed at
+		# once
+		self._conn.commit()
+		schemas = [ ]
+		try:
+			for (index, filename) in enumerate(filenames):
+				schema = "source%d" % (index)
+				self._cursor.execute("ATTACH DATABASE ? AS %s;" % (schema), (filename, ))
+				schemas.append(schema)
+			try:
+				yield schemas
+				self._conn.commit()
+			except:
+				self._conn.rollback()
+				raise
+		finally:
+			for schema in schemas:
+				self._cursor.execute("DETACH DATABASE %s;" % (schema))
+
+	def _import_from(self, schema, source_filename, side_uuids, document_metadata):
+		if side_uuids is None:
+			side_uuids = [ row[0] for row in self._cursor.execute("SELECT side_uuid FROM %s.image_original ORDER BY orderno ASC;" % (schema)).fetchall() ]
+		next_orderno = self._cursor.execute("SELECT COALESCE(MAX(orderno) + 1, 0) FROM image_original;").fetchone()[0]
+		for (index, side_uuid) in enumerate(side_uuids):
+			self._cursor.execute("""INSERT INTO image_original (side_uuid, sheet_uuid, sheet_side, data, datatype, width, height, resolution_dpi, img_hash_sha256, orderno)
+					SELECT side_uuid, sheet_uuid, sheet_side, data, datatype, width, height, resolution_dpi, img_hash_sha256, ? FROM %s.image_original WHERE side_uuid = ?;""" % (schema), (next_orderno + index, side_uuid))
+			if self._cursor.rowcount != 1:
+				raise FileNotFoundError("No side with UUID %s found in %s." % (side_uuid, source_filename))
+			self._cursor.execute("""INSERT INTO image_derivative (side_uuid, derivative_type, data, datatype, width, height, resolution_dpi)
+					SELECT side_uuid, derivative_type, data, datatype, width, height, resolution_dpi FROM %s.image_derivative WHERE side_uuid = ? ORDER BY derivative_id ASC;""" % (schema), (side_uuid, ))
+			self._cursor.execute("INSERT INTO image_meta (side_uuid, key, value) SELECT side_uuid, key, value FROM %s.image_meta WHERE side_uuid = ?;" % (schema), (side_uuid, ))
+		if document_metadata:
+			# Existing properties take precedence; the document UUID
+			# always stays the one of this document
+			self._cursor.execute("INSERT OR IGNORE INTO document_meta (key, value) SELECT key, value FROM %s.document_meta WHERE key != 'doc_uuid';" % (schema))
+			self._cursor.execute("INSERT OR IGNORE INTO document_tags (tag) SELECT tag FROM %s.document_tags;" % (schema))
+		return side_uuids
+
+	def import_pages(self, source_filename, side_uuids = None, document_metadata = False):
+		# Copies pages including their derivatives and side properties from
+		# another MUD within SQLite, without decoding or re-hashing images.
+		# Either all pages are imported or none.
+		with self._attached([ source_filename ]) as schemas:
+			return self._import_from(schemas[0], source_filename, side_uuids, document_metadata)
+
+	def merge_documents(self, source_filenames, document_metadata = True):
+		# Appends all pages of all sources in a single transaction, so either
+		# all documents are merged or none is
+		with self._attached(source_filenames) as schemas:
+			return [ self._import_from(schema, source_filename, None, document_metadata) for (schema, source_filename) in zip(schemas, source_filenames) ]
+
+	def _set_page_order(self, side_uuids):
+		# Order numbers are unique, so they are first assigned negated to not
+		# collide with existing ones
+		for (orderno, side_uuid) in enumerate(side_uuids):
+			self._cursor.execute("UPDATE image_original SET orderno = ? WHERE side_uuid = ?;", (-1 - orderno, side_uuid))
+		self._cursor.execute("UPDATE image_original SET orderno = -1 - orderno;")
+
+	def reorder_pages(self, side_uuids):
+		if sorted(side_uuids) != sorted(self.get_page_order()):
+			raise ValueError("New page order of %s must contain every page exactly once." % (self.filename))
+		try:
+			self._set_page_order(side_uuids)
+			self._conn.commit()
+		except:
+			self._conn.rollback()
+			raise
+
+	def delete_pages(self, side_uuids):
+		page_order = self.get_page_order()
+		missing = set(side_uuids) - set(page_order)
+		if len(missing) > 0:
+			raise FileNotFoundError("No side with UUID %s found in MUD." % (", ".join(sorted(missing))))
+		try:
+			for side_uuid in side_uuids:
+				self._cursor.execute("DELETE FROM image_derivative WHERE side_uuid = ?;", (side_uuid, ))
+				self._cursor.execute("DELETE FROM image_meta WHERE side_uuid = ?;", (side_uuid, ))
+				self._cursor.execute("DELETE FROM image_original WHERE side_uuid = ?;", (side_uuid, ))
+			self._set_page_order([ side_uuid for side_uuid in page_order if side_uuid not in set(side_uuids) ])
+			self._conn.commit()
+		except:
+			self._conn.rollback()
+			raise
+
+	def split_off(self, side_uuids, output_filename):
+		# The new document is completely written before the pages are removed
+		# from this one, so an interruption cannot lose pages
+		self._conn.commit()
+		with MultiDoc(output_filename) as output_doc:
+			output_doc.import_pages(self.filename, side_uuids, document_metadata = True)
+			output_doc.set_document_property("doc_uuid", str(uuid.uuid4()))
+		self.delete_pages(side_uuids)
+
+	@contextlib.contextmanager
+	def open_blob(self, table, rowid):
+		if hasattr(self._conn, "blobopen"):
+			with self._conn.blobopen(table, "data", rowid, readonly = True) as blob:
+				metrics.count("sqlite_blob_bytes_total", len(blob), direction = "read")
+				yield blob
+		else:
+			data = self._cursor.execute("SELECT data FROM %s WHERE rowid = ?;" % (table), (rowid, )).fetchone()[0]
+			metrics.count("sqlite_blob_bytes_total", len(data), direction = "read")
+			yield io.BytesIO(data)
+
+	def quick_check(self):
+		result = [ row[0] for row in self._cursor.execute("PRAGMA quick_check;").fetchall() ]
+		return [ ] if (result == [ "ok" ]) else result
+
+	def verify_originals(self, chunk_size = 1024 * 1024):
+		# Yields (side_uuid, stored hash, actual hash, size); blobs are
+		# streamed so that hashing does not hold whole images in memory
+		rows = self._cursor.execute("SELECT rowid, side_uuid, img_hash_sha256 FROM image_original ORDER BY orderno ASC;").fetchall()
+		for (rowid, side_uuid, img_hash_sha256) in rows:
+			hasher = hashlib.sha256()
+			size = 0
+			with self.open_blob("image_original", rowid) as blob:
+				while True:
+					chunk = blob.read(chunk_size)
+					if len(chunk) == 0:
+						break
+					hasher.update(chunk)
+					size += len(chunk)
+			yield (side_uuid, img_hash_sha256, hasher.hexdigest(), size)
+
+	def iter_content(self):
+		# Yields all image blobs in the form (table, rowid, path, size); paths
+		# are relative and use the same layout as dump_all_content()
+		order = self._cursor.execute("SELECT rowid, side_uuid, datatype, LENGTH(data) FROM image_original ORDER BY orderno ASC;").fetchall()
+		pageno_by_side_uuid = { }
+		for (pageno, (rowid, side_uuid, datatype, size)) in enumerate(order, 1):
+			pageno_by_side_uuid[side_uuid] = pageno
+			yield ("image_original", rowid, "original/%03d_%s.%s" % (pageno, side_uuid, datatype), size)
+
+		derivatives = self._cursor.execute("SELECT derivative_id, side_uuid, derivative_type, datatype, LENGTH(data) FROM image_derivative ORDER BY derivative_id ASC;").fetchall()
+		for (derivative_id, side_uuid, derivative_type, datatype, size) in derivatives:
+			dirname = "thumbs" if (derivative_type == "thumb") else derivative_type
+			yield ("image_derivative", derivative_id, "%s/%03d_%s.%s" % (dirname, derivative_id, side_uuid, datatype), size)
+
+	def get_manifest(self):
+		pages = [ ]
+		derivatives = collections.defaultdict(list)
+		for (derivative_id, side_uuid, derivative_type, datatype, width, height, resolution_dpi) in self._cursor.execute("SELECT derivative_id, side_uuid, derivative_type, datatype, width, height, resolution_dpi FROM image_derivative ORDER BY derivative_id ASC;").fetchall():
+			derivatives[side_uuid].append({
+				"derivative_id":	derivative_id,
+				"derivative_type":	derivative_type,
+				"datatype":			datatype,
+				"width":			width,
+				"height":			height,
+				"resolution_dpi":	resolution_dpi,
+			})
+		for (side_uuid, sheet_uuid, sheet_side, datatype, width, height, resolution_dpi, img_hash_sha256) in self._cursor.execute("SELECT side_uuid, sheet_uuid, sheet_side, datatype, width, height, resolution_dpi, img_hash_sha256 FROM image_original ORDER BY orderno ASC;").fetchall():
+			pages.append({
+				"side_uuid":		side_uuid,
+				"sheet_uuid":		sheet_uuid,
+				"sheet_side":		sheet_side,
+				"datatype":			datatype,
+				"width":			width,
+				"height":			height,
+				"resolution_dpi":	resolution_dpi,
+				"img_hash_sha256":	img_hash_sha256,
+				"properties":		self.get_page_properties(side_uuid),
+				"derivatives":		derivatives[side_uuid],
+			})
+		return {
+			"properties":	self.get_document_properties(),
+			"tags":			sorted(self.tags),
+			"pages":		pages,
+		}
+
 	def dump_all_content(self, directory):
-		with contextlib.suppress(FileExistsError):
-			os.makedirs(directory + "/original/")
-		with contextlib.suppress(FileExistsError):
-			os.makedirs(directory + "/enhanced/")
-		with contextlib.suppress(FileExistsError):
-			os.makedirs(directory + "/thumbs/")
-		for (pageno, side_uuid) in enumerate(self.get_page_order(), 1):
-			info = self.get_side_images_info(side_uuid)
-			with open("%s/original/%03d_%s.%s" % (directory, pageno, side_uuid, info.original.datatype), "wb") as f:
-				img_data = self.get_page_image(side_uuid, allow_enhanced = False)
-				f.write(img_data)
-
-			for (derivative_type, derivatives) in [ ("enhanced", info.enhanced), ("thumbs", info.thumbs) ]:
-				for derivative in derivatives:
-					with open("%s/%s/%03d_%s.%s" % (directory, derivative_type, derivative.derivative_id, side_uuid, derivative.image_info.datatype), "wb") as f:
-						img_data = self.get_derived_image(derivative.derivative_id)
-						f.write(img_data)
-
-
-#			orig_filename = "%05d_%s.
-
-#		def get_page_order(self):
-#		return [ row[0] for row in self._cursor.execute("SELECT side_uuid FROM image_original ORDER BY orderno ASC;").fetchall() ]
+		for (table, rowid, path, size) in self.iter_content():
+			with contextlib.suppress(FileExistsError):
+				os.makedirs(os.path.dirname(directory + "/" + path))
+			with open(directory + "/" + path, "wb") as f, self.open_blob(table, rowid) as blob:
+				shutil.copyfileobj(blob, f)
+		with open(directory + "/manifest.json", "w") as f:
+			json.dump(self.get_manifest(), f, indent = 4, sort_keys = True)
 
 	def __enter__(self):
 		return self
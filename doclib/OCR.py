@@ -0,0 +1,180 @@
+#	bulkscan - Document scanning and maintenance solution
+#	Copyright (C) 2019-2023 Johannes Bauer
+#
+#	This file is part of bulkscan.
+#
+#	bulkscan is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	bulkscan is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with bulkscan; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import time
+import hashlib
+import threading
+import collections
+import subprocess
+from .Metrics import metrics
+
+class OCRException(Exception): pass
+
+class TesseractOCR():
+	def __init__(self, language = "eng", binary = "tesseract"):
+		self._language = language
+		self._binary = binary
+
+	@property
+	def name(self):
+		return "tesseract"
+
+	@property
+	def language(self):
+		return self._language
+
+	def recognize(self, img_data):
+		# Parallelism comes from the worker pool, so tesseract's own OpenMP
+		# threads would only oversubscribe the CPUs
+		env = dict(os.environ, OMP_THREAD_LIMIT = "1")
+		try:
+			tsv = metrics.check_output([ self._binary, "stdin", "stdout", "-l", self._language, "tsv" ], input = img_data, env = env, stderr = subprocess.DEVNULL)
+		except (OSError, subprocess.CalledProcessError) as e:
+			raise OCRException("%s failed: %s" % (self._binary, str(e)))
+		return self._parse_tsv(tsv.decode("utf-8"))
+
+	@staticmethod
+	def _parse_tsv(tsv):
+		lines = tsv.rstrip("\n").split("\n")
+		header = lines[0].split("\t")
+		result = { "width": None, "height": None, "words": [ ] }
+		text_lines = collections.OrderedDict()
+		for line in lines[1:]:
+			row = dict(zip(header, line.split("\t")))
+			level = int(row["level"])
+			if level == 1:
+				result["width"] = int(row["width"])
+				result["height"] = int(row["height"])
+			elif (level == 5) and (row.get("text", "").strip() != ""):
+				(block, par, line_no) = (int(row["block_num"]), int(row["par_num"]), int(row["line_num"]))
+				result["words"].append({
+					"text":		row["text"],
+					"left":		int(row["left"]),
+					"top":		int(row["top"]),
+					"width":	int(row["width"]),
+					"height":	int(row["height"]),
+					"conf":		float(row["conf"]),
+					"block":	block,
+					"par":		par,
+					"line":		line_no,
+				})
+				text_lines.setdefault((block, par, line_no), [ ]).append(row["text"])
+		result["text"] = "\n".join(" ".join(words) for words in text_lines.values())
+		return result
+
+class OCRProcessor():
+	def __init__(self, engine, executor, max_in_flight = 2):
+		self._engine = engine
+		self._executor = executor
+		# Bounds the number of page images in memory over all documents that
+		# are processed concurrently
+		self._in_flight = threading.BoundedSemaphore(max_in_flight)
+
+	@staticmethod
+	def _get_source(doc, side_uuid, existing):
+		# The enhanced image with the highest resolution is preferred, since
+		# it usually recognizes better than the raw scan
+		side_info = doc.get_side_images_info(side_uuid)
+		if len(side_info.enhanced) > 0:
+			enhanced = max(side_info.enhanced, key = lambda derivative: derivative.image_info.width)
+			img_data = doc.get_derived_image(enhanced.derivative_id)
+			return ("enhanced", img_data, hashlib.sha256(img_data).hexdigest())
+		img_hash = doc.get_original_hash(side_uuid)
+		if (img_hash is not None) and (existing is not None) and (existing.get("source_hash_sha256") == img_hash):
+			# Skip loading the original at all when it is already recognized
+			return ("original", None, img_hash)
+		img_data = doc.get_page_image(side_uuid, allow_enhanced = False)
+		return ("original", img_data, img_hash or hashlib.sha256(img_data).hexdigest())
+
+	def _recognize(self, img_data):
+		t0 = time.monotonic()
+		with metrics.timed("ocr_duration_seconds", engine = self._engine.name):
+			result = self._engine.recognize(img_data)
+		return (result, time.monotonic() - t0)
+
+	def _release_slot(self, future):
+		self._in_flight.release()
+
+	def recognize_document(self, doc, progress_callback = None):
+		# Images are read in the calling thread, which owns the SQLite
+		# connection; only recognition runs in the worker pool. Nothing is
+		# written to the document, so that the caller can decide when and
+		# under which lock to store the results.
+		stats = collections.Counter()
+		t0 = time.monotonic()
+		pending = [ ]
+		page_order = doc.get_page_order()
+		for (pageno, side_uuid) in enumerate(page_order):
+			existing = doc.get_ocr(side_uuid)
+			future = None
+			self._in_flight.acquire()
+			try:
+				(source, img_data, source_hash) = self._get_source(doc, side_uuid, existing)
+				if (existing is None) or (existing.get("source_hash_sha256") != source_hash):
+					future = self._executor.submit(self._recognize, img_data)
+					future.add_done_callback(self._release_slot)
+			finally:
+				if future is None:
+					self._in_flight.release()
+			if future is None:
+				stats["skipped"] += 1
+				continue
+			pending.append((side_uuid, source, source_hash, future))
+			if progress_callback is not None:
+				progress_callback(pageno, len(page_order))
+
+		results = { }
+		for (side_uuid, source, source_hash, future) in pending:
+			try:
+				(result, duration) = future.result()
+			except OCRException:
+				stats["failed"] += 1
+				metrics.count("ocr_failures_total", engine = self._engine.name)
+				continue
+			result.update({
+				"engine":				self._engine.name,
+				"language":				self._engine.language,
+				"source":				source,
+				"source_hash_sha256":	source_hash,
+			})
+			results[side_uuid] = result
+			stats["words"] += len(result["words"])
+			stats["engine_seconds"] += duration
+		stats["seconds"] = time.monotonic() - t0
+		return (results, stats)
+
+	def store_results(self, doc, results):
+		# Pages may have been removed from the document while it was being
+		# recognized
+		page_order = set(doc.get_page_order())
+		stored = 0
+		for (side_uuid, result) in results.items():
+			if side_uuid in page_order:
+				doc.set_ocr(side_uuid, result)
+				stored += 1
+				metrics.count("ocr_pages_total", engine = self._engine.name)
+		return stored
+
+	def process_document(self, doc, progress_callback = None):
+		(results, stats) = self.recognize_document(doc, progress_callback = progress_callback)
+		stats["pages"] = self.store_results(doc, results)
+		return stats
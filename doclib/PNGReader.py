@@ -0,0 +1,132 @@
+#	bulkscan - Document scanning and maintenance solution
+#	Copyright (C) 2019-2023 Johannes Bauer
+#
+#	This file is part of bulkscan.
+#
+#	bulkscan is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	bulkscan is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with bulkscan; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import struct
+import zlib
+import collections
+
+class PNGReaderException(Exception): pass
+
+class PNGReader():
+	_SIGNATURE = bytes.fromhex("89 50 4e 47 0d 0a 1a 0a")
+	_TEXT_CHUNK_TYPES = set([ b"tEXt", b"zTXt", b"iTXt" ])
+	_Chunk = collections.namedtuple("Chunk", [ "chunk_type", "data" ])
+	_PNGInfo = collections.namedtuple("PNGInfo", [ "width", "height", "bit_depth", "color_type", "resolution_dpi", "text" ])
+
+	def __init__(self, filename):
+		self._filename = filename
+
+	def _read_chunks(self, f):
+		if f.read(8) != self._SIGNATURE:
+			raise PNGReaderException("%s: not a PNG file" % (self._filename))
+		while True:
+			header = f.read(8)
+			if len(header) != 8:
+				raise PNGReaderException("%s: truncated PNG file" % (self._filename))
+			(length, chunk_type) = struct.unpack(">L4s", header)
+			if chunk_type == b"IDAT":
+				# Skip over image data without reading it, we only care about
+				# the header and the text chunks
+				f.seek(length + 4, 1)
+				continue
+			data = f.read(length)
+			f.seek(4, 1)
+			yield self._Chunk(chunk_type = chunk_type, data = data)
+			if chunk_type == b"IEND":
+				break
+
+	@staticmethod
+	def _write_chunk(f, chunk):
+		f.write(struct.pack(">L4s", len(chunk.data), chunk.chunk_type))
+		f.write(chunk.data)
+		f.write(struct.pack(">L", zlib.crc32(chunk.chunk_type + chunk.data)))
+
+	def get_text_chunks(self):
+		with open(self._filename, "rb") as f:
+			return [ chunk for chunk in self._read_chunks(f) if chunk.chunk_type in self._TEXT_CHUNK_TYPES ]
+
+	def replace_text_chunks(self, text_chunks, output_filename):
+		# Copies the PNG verbatim, but substitutes all text chunks by the given
+		# ones, which are placed right after the IHDR chunk
+		with open(self._filename, "rb") as f, open(output_filename, "wb") as outf:
+			if f.read(8) != self._SIGNATURE:
+				raise PNGReaderException("%s: not a PNG file" % (self._filename))
+			outf.write(self._SIGNATURE)
+			while True:
+				header = f.read(8)
+				if len(header) != 8:
+					raise PNGReaderException("%s: truncated PNG file" % (self._filename))
+				(length, chunk_type) = struct.unpack(">L4s", header)
+				if chunk_type in self._TEXT_CHUNK_TYPES:
+					f.seek(length + 4, 1)
+					continue
+				outf.write(header)
+				outf.write(f.read(length + 4))
+				if chunk_type == b"IHDR":
+					for chunk in text_chunks:
+						self._write_chunk(outf, chunk)
+				elif chunk_type == b"IEND":
+					break
+
+	@staticmethod
+	def _decode_text(chunk):
+		if chunk.chunk_type == b"tEXt":
+			(keyword, text) = chunk.data.split(b"\x00", 1)
+			return (keyword.decode("latin1"), text.decode("latin1"))
+		elif chunk.chunk_type == b"zTXt":
+			(keyword, text) = chunk.data.split(b"\x00", 1)
+			return (keyword.decode("latin1"), zlib.decompress(text[1:]).decode("latin1"))
+		elif chunk.chunk_type == b"iTXt":
+			(keyword, text) = chunk.data.split(b"\x00", 1)
+			(compressed, text) = (text[0], text[2:])
+			(language_tag, translated_keyword, text) = text.split(b"\x00", 2)
+			if compressed:
+				text = zlib.decompress(text)
+			return (keyword.decode("latin1"), text.decode("utf-8"))
+		return None
+
+	def read(self):
+		width = None
+		height = None
+		bit_depth = None
+		color_type = None
+		resolution_dpi = None
+		text = { }
+		with open(self._filename, "rb") as f:
+			for chunk in self._read_chunks(f):
+				if chunk.chunk_type == b"IHDR":
+					(width, height, bit_depth, color_type) = struct.unpack(">LLBB", chunk.data[:10])
+				elif chunk.chunk_type == b"pHYs":
+					(ppu_x, ppu_y, unit) = struct.unpack(">LLB", chunk.data)
+					if unit == 1:
+						# Pixels per meter
+						resolution_dpi = (ppu_x + ppu_y) / 2 * 0.0254
+				else:
+					text_entry = self._decode_text(chunk)
+					if text_entry is not None:
+						(keyword, value) = text_entry
+						text[keyword.lower()] = value
+		if width is None:
+			raise PNGReaderException("%s: no IHDR chunk present" % (self._filename))
+		return self._PNGInfo(width = width, height = height, bit_depth = bit_depth, color_type = color_type, resolution_dpi = resolution_dpi, text = text)
+
+	def read_comment(self):
+		return self.read().text.get("comment")
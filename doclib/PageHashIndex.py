@@ -0,0 +1,72 @@
+#	bulkscan - Document scanning and maintenance solution
+#	Copyright (C) 2019-2023 Johannes Bauer
+#
+#	This file is part of bulkscan.
+#
+#	bulkscan is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	bulkscan is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with bulkscan; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import collections
+
+class PageHashIndex():
+	def __init__(self):
+		self._sides_by_hash = collections.defaultdict(set)
+		self._hashes_by_doc = { }
+
+	def add(self, doc_uuid, page_hashes):
+		# page_hashes maps each side UUID to the set of hashes that identify
+		# its original image
+		self.remove(doc_uuid)
+		self._hashes_by_doc[doc_uuid] = page_hashes
+		for (side_uuid, hashes) in page_hashes.items():
+			for img_hash in hashes:
+				self._sides_by_hash[img_hash].add((doc_uuid, side_uuid))
+
+	def remove(self, doc_uuid):
+		page_hashes = self._hashes_by_doc.pop(doc_uuid, None)
+		if page_hashes is None:
+			return
+		for (side_uuid, hashes) in page_hashes.items():
+			for img_hash in hashes:
+				sides = self._sides_by_hash[img_hash]
+				sides.discard((doc_uuid, side_uuid))
+				if len(sides) == 0:
+					del self._sides_by_hash[img_hash]
+
+	def lookup(self, img_hash):
+		return set(self._sides_by_hash.get(img_hash, set()))
+
+	def duplicate_pages(self):
+		groups = set()
+		for sides in self._sides_by_hash.values():
+			if len(sides) > 1:
+				groups.add(frozenset(sides))
+		return sorted(sorted(group) for group in groups)
+
+	def duplicate_documents(self):
+		# A document is duplicated when all of its pages are also contained
+		# in some other single document
+		result = [ ]
+		for (doc_uuid, page_hashes) in sorted(self._hashes_by_doc.items()):
+			containing_docs = None
+			for hashes in page_hashes.values():
+				docs = set(other_doc_uuid for img_hash in hashes for (other_doc_uuid, other_side_uuid) in self._sides_by_hash[img_hash] if (other_doc_uuid != doc_uuid))
+				containing_docs = docs if (containing_docs is None) else (containing_docs & docs)
+				if len(containing_docs) == 0:
+					break
+			if (containing_docs is not None) and (len(containing_docs) > 0):
+				result.append((doc_uuid, sorted(containing_docs)))
+		return result
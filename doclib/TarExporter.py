@@ -0,0 +1,101 @@
+#	bulkscan - Document scanning and maintenance solution
+#	Copyright (C) 2019-2023 Johannes Bauer
+#
+#	This file is part of bulkscan.
+#
+#	bulkscan is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	bulkscan is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with bulkscan; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import io
+import json
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+
+class TarExporter():
+	# Many documents can be exported concurrently from different threads.
+	# Members are copied by the exporting thread in chunks into spooled
+	# temporary files and handed to a single writer thread through a bounded
+	# queue. Spooled files move to disk once they exceed spool_size, so memory
+	# usage is limited to max_queued * spool_size bytes regardless of the
+	# size of the images.
+	def __init__(self, fileobj, max_queued = 8, spool_size = 1024 * 1024):
+		self._tar = tarfile.open(fileobj = fileobj, mode = "w|")
+		self._queue = queue.Queue(maxsize = max_queued)
+		self._spool_size = spool_size
+		self._error = None
+		self._writer = threading.Thread(target = self._writer_thread)
+		self._writer.start()
+
+	@staticmethod
+	def document_prefix(filename):
+		path = os.path.normpath(filename).lstrip("/")
+		path = "/".join(component for component in path.split("/") if component != "..")
+		if path.endswith(".mud"):
+			path = path[:-4]
+		return path
+
+	def _writer_thread(self):
+		while True:
+			item = self._queue.get()
+			if item is None:
+				break
+			(tarinfo, member_file) = item
+			with member_file:
+				if self._error is not None:
+					# Keep draining so that producers do not block forever
+					continue
+				try:
+					self._tar.addfile(tarinfo, member_file)
+				except Exception as e:
+					self._error = e
+
+	def _put(self, name, member_file, mtime):
+		if self._error is not None:
+			member_file.close()
+			raise self._error
+		tarinfo = tarfile.TarInfo(name)
+		tarinfo.size = member_file.seek(0, io.SEEK_END)
+		tarinfo.mtime = mtime
+		tarinfo.mode = 0o644
+		member_file.seek(0)
+		self._queue.put((tarinfo, member_file))
+
+	def add_document(self, doc, prefix = None):
+		if prefix is None:
+			prefix = self.document_prefix(doc.filename)
+		mtime = os.stat(doc.filename).st_mtime
+		manifest = json.dumps(doc.get_manifest(), indent = 4, sort_keys = True).encode("utf-8")
+		self._put(prefix + "/manifest.json", io.BytesIO(manifest), mtime)
+		for (table, rowid, path, size) in doc.iter_content():
+			member_file = tempfile.SpooledTemporaryFile(max_size = self._spool_size)
+			try:
+				with doc.open_blob(table, rowid) as blob:
+					shutil.copyfileobj(blob, member_file, 64 * 1024)
+			except:
+				member_file.close()
+				raise
+			self._put(prefix + "/" + path, member_file, mtime)
+
+	def close(self):
+		self._queue.put(None)
+		self._writer.join()
+		self._tar.close()
+		if self._error is not None:
+			raise self._error
@@ -0,0 +1,100 @@
+#	bulkscan - Document scanning and maintenance solution
+#	Copyright (C) 2019-2023 Johannes Bauer
+#
+#	This file is part of bulkscan.
+#
+#	bulkscan is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	bulkscan is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with bulkscan; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import time
+import sqlite3
+import textwrap
+import threading
+import contextlib
+
+class VerificationLedger():
+	def __init__(self, filename):
+		self._filename = filename
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(self._filename, check_same_thread = False)
+		self._cursor = self._conn.cursor()
+		with contextlib.suppress(sqlite3.OperationalError):
+			self._cursor.execute(textwrap.dedent("""\
+			CREATE TABLE verified_document (
+				filename varchar PRIMARY KEY,
+				doc_uuid uuid NULL,
+				mud_mtime_ns integer NOT NULL,
+				verified_utc float NOT NULL,
+				success boolean NOT NULL
+			);
+			"""))
+			self._conn.commit()
+
+		with contextlib.suppress(sqlite3.OperationalError):
+			self._cursor.execute(textwrap.dedent("""\
+			CREATE TABLE verified_side (
+				filename varchar NOT NULL,
+				side_uuid uuid NOT NULL,
+				mud_mtime_ns integer NOT NULL,
+				verified_utc float NOT NULL,
+				success boolean NOT NULL,
+				PRIMARY KEY(filename, side_uuid)
+			);
+			"""))
+			self._conn.commit()
+
+	def _last_verified(self, filename, mtime_ns):
+		# Returns the time of the last successful verification of the file in
+		# its current state or None
+		row = self._cursor.execute("SELECT mud_mtime_ns, verified_utc, success FROM verified_document WHERE filename = ?;", (filename, )).fetchone()
+		if (row is None) or (row[0] != mtime_ns) or (not row[2]):
+			return None
+		return row[1]
+
+	def select_due(self, filenames, max_age = None, limit = None):
+		# Files that were never verified, changed since or failed come first,
+		# then the ones verified longest ago
+		now = time.time()
+		candidates = [ ]
+		with self._lock:
+			for filename in filenames:
+				filename = os.path.realpath(filename)
+				try:
+					mtime_ns = os.stat(filename).st_mtime_ns
+				except FileNotFoundError:
+					continue
+				verified_utc = self._last_verified(filename, mtime_ns)
+				if (verified_utc is None) or (max_age is None) or (now - verified_utc >= max_age):
+					candidates.append((0 if (verified_utc is None) else verified_utc, filename))
+		candidates.sort()
+		if limit is not None:
+			candidates = candidates[:limit]
+		return [ filename for (verified_utc, filename) in candidates ]
+
+	def record(self, filename, doc_uuid, mtime_ns, side_results, success):
+		filename = os.path.realpath(filename)
+		now = time.time()
+		with self._lock:
+			self._cursor.execute("DELETE FROM verified_side WHERE filename = ?;", (filename, ))
+			for (side_uuid, side_success) in side_results.items():
+				self._cursor.execute("INSERT INTO verified_side (filename, side_uuid, mud_mtime_ns, verified_utc, success) VALUES (?, ?, ?, ?, ?);", (filename, side_uuid, mtime_ns, now, side_success))
+			self._cursor.execute("INSERT OR REPLACE INTO verified_document (filename, doc_uuid, mud_mtime_ns, verified_utc, success) VALUES (?, ?, ?, ?, ?);", (filename, doc_uuid, mtime_ns, now, success))
+			self._conn.commit()
+
+	def close(self):
+		with self._lock:
+			self._conn.close()
@@ -21,4 +21,10 @@
 
 from .MultiDoc import MultiDoc
 from .MetaReader import MetaReader, MetaReaderException
+from .PNGReader import PNGReader, PNGReaderException
+from .Metrics import Metrics, metrics
+from .PageHashIndex import PageHashIndex
 from .DocLibrary import DocLibrary
+from .TarExporter import TarExporter
+from .VerificationLedger import VerificationLedger
+from .OCR import TesseractOCR, OCRProcessor, OCRException
@@ -21,58 +21,167 @@
 
 import os
 import json
+import bisect
+import heapq
+import threading
 import collections
+import doclib
+
+class PrefixIndex():
+	def __init__(self, values):
+		self._entries = sorted((value.lower(), value) for value in values)
+
+	def query(self, prefix, limit = None, usage = None):
+		prefix = prefix.lower()
+		matches = [ ]
+		index = bisect.bisect_left(self._entries, (prefix, ))
+		while (index < len(self._entries)) and self._entries[index][0].startswith(prefix):
+			matches.append(self._entries[index][1])
+			index += 1
+		if usage is not None:
+			rank = lambda value: (-usage[value], value.lower())
+			if limit is None:
+				matches.sort(key = rank)
+			else:
+				matches = heapq.nsmallest(limit, matches, key = rank)
+		elif limit is not None:
+			matches = matches[:limit]
+		return matches
 
 class AutocompleteDB():
-	def __init__(self, filename):
+	def __init__(self, filename, write_delay = 5):
 		self._filename = filename
-		self._tag = set()
-		self._docname_by_peer = collections.defaultdict(set)
-		self._load(filename)
+		self._write_delay = write_delay
+		self._refcount = {
+			"tag":			collections.Counter(),
+			"peer":			collections.Counter(),
+			"docname":		collections.Counter(),
+		}
+		self._docnames_by_peer = collections.defaultdict(collections.Counter)
+		self._views = { }
+		self._lock = threading.RLock()
+		self._write_lock = threading.Lock()
+		self._write_timer = None
 		self._dirty = False
 
-	def _load(self, filename):
-		with open(filename) as f:
-			json_data = json.load(f)
-		self._tag |= set(json_data.get("tag", [ ]))
-		for (key, values) in json_data.get("docname_by_peer", { }).items():
-			self._docname_by_peer[key] |= set(values)
+	def attach_library(self, library):
+		# All state is derived from the library; the JSON file is only written
+		# as an export of it, never read back
+		with self._lock:
+			for counter in self._refcount.values():
+				counter.clear()
+			self._docnames_by_peer.clear()
+			self._views = { }
+			library.add_listener(self._library_event)
+			for (doc_uuid, entry) in library:
+				self._update_refcounts(entry, 1)
+			self._schedule_write()
 
-	def get_all(self):
-		write_data = {
-			"tag":				sorted(list(self._tag)),
-			"docname_by_peer":	{ key: sorted(list(value)) for (key, value) in self._docname_by_peer.items() },
-		}
-		return write_data
+	@staticmethod
+	def _entry_values(entry):
+		properties = entry.metadata["properties"]
+		return (entry.metadata["tags"], properties.get("peer"), properties.get("docname"))
 
-	def put_tag(self, tag):
-		if tag not in self._tag:
-			self._tag.add(tag)
-			self._dirty = True
+	def _count(self, counter, key, delta):
+		previous = counter[key]
+		counter[key] += delta
+		if counter[key] <= 0:
+			del counter[key]
+		if (previous > 0) != (counter[key] > 0):
+			# Vocabulary itself changed, sorted views need to be rebuilt
+			self._views = { }
+		self._dirty = True
 
-	def put_tags(self, tags):
+	def _update_refcounts(self, entry, delta):
+		(tags, peer, docname) = self._entry_values(entry)
 		for tag in tags:
-			self.put_tag(tag)
-
-	def put_peer_docname(self, peer, docname):
+			self._count(self._refcount["tag"], tag, delta)
 		if peer is not None:
-			if peer not in self._docname_by_peer:
-				self._docname_by_peer[peer]
-				self._dirty = True
-			if (docname is not None) and (docname not in self._docname_by_peer[peer]):
-				self._docname_by_peer[peer].add(docname)
-				self._dirty = True
+			self._count(self._refcount["peer"], peer, delta)
+			if docname is not None:
+				self._count(self._docnames_by_peer[peer], docname, delta)
+				self._count(self._refcount["docname"], docname, delta)
+			if len(self._docnames_by_peer[peer]) == 0:
+				del self._docnames_by_peer[peer]
+
+	def _library_event(self, event, old_entry, new_entry):
+		with self._lock:
+			if old_entry is not None:
+				self._update_refcounts(old_entry, -1)
+			if new_entry is not None:
+				self._update_refcounts(new_entry, 1)
+			self._schedule_write()
+
+	def _get_view(self, name):
+		view = self._views.get(name)
+		doclib.metrics.cache_access("autocomplete_view", view is not None)
+		if view is None:
+			if name in [ "tag", "peer", "docname" ]:
+				view = PrefixIndex(self._refcount[name].keys())
+			else:
+				(category, peer) = name
+				view = PrefixIndex(self._docnames_by_peer.get(peer, { }).keys())
+			self._views[name] = view
+		return view
+
+	def query_tag(self, prefix, limit = None):
+		with self._lock:
+			return self._get_view("tag").query(prefix, limit = limit, usage = self._refcount["tag"])
+
+	def query_peer(self, prefix, limit = None):
+		with self._lock:
+			return self._get_view("peer").query(prefix, limit = limit, usage = self._refcount["peer"])
+
+	def query_docname(self, prefix, limit = None, peer = None):
+		with self._lock:
+			if peer is None:
+				return self._get_view("docname").query(prefix, limit = limit, usage = self._refcount["docname"])
+			else:
+				usage = self._docnames_by_peer.get(peer, collections.Counter())
+				return self._get_view(("docname", peer)).query(prefix, limit = limit, usage = usage)
+
+	def get_all(self):
+		with self._lock:
+			docname_by_peer = { peer: dict(self._docnames_by_peer.get(peer, { })) for peer in self._refcount["peer"] }
+			write_data = {
+				"tag":				sorted(self._refcount["tag"]),
+				"docname_by_peer":	{ key: sorted(value) for (key, value) in docname_by_peer.items() },
+				"usage": {
+					"tag":				dict(self._refcount["tag"]),
+					"peer":				dict(self._refcount["peer"]),
+					"docname_by_peer":	docname_by_peer,
+				},
+			}
+			return write_data
+
+	def _schedule_write(self):
+		if (self._write_timer is None) and self._dirty:
+			self._write_timer = threading.Timer(self._write_delay, self.write)
+			self._write_timer.daemon = True
+			self._write_timer.start()
+
+	def flush(self):
+		with self._lock:
+			if self._write_timer is not None:
+				self._write_timer.cancel()
+		self.write()
 
 	def write(self):
-		if not self._dirty:
-			return
-		write_data = self.get_all()
-		with open(self._filename + "_", "w") as f:
-			json.dump(write_data, f)
-		os.rename(self._filename + "_", self._filename)
-		self._dirty = False
+		with self._write_lock:
+			with self._lock:
+				self._write_timer = None
+				if not self._dirty:
+					return
+				write_data = self.get_all()
+				self._dirty = False
+			with open(self._filename + "_", "w") as f:
+				json.dump(write_data, f)
+			os.rename(self._filename + "_", self._filename)
 
 if __name__ == "__main__":
 	acdb = AutocompleteDB("autocomplete.json")
+	library = doclib.DocLibrary()
+	acdb.attach_library(library)
+	library.add_directory("documents/")
 	print(acdb.get_all())
-	acdb.write()
+	acdb.flush()
@@ -20,17 +20,34 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import os
+import atexit
 import time
 import re
 import json
 import uuid
+import hashlib
+import sqlite3
 import subprocess
 import contextlib
 import tempfile
 import shutil
 import doclib
 import datetime
+import threading
+import concurrent.futures
 from .AutocompleteDB import AutocompleteDB
+from .IncomingIndex import IncomingIndex
+from .JobServer import JobServer
+from .RenditionCache import RenditionCache
+
+class ControllerException(Exception): pass
+class FilesReservedException(ControllerException): pass
+class NoSuchDocumentException(ControllerException): pass
+class InvalidDocumentOperationException(ControllerException): pass
+class PagesAlreadyArchivedException(ControllerException):
+	def __init__(self, msg, archived_pages):
+		super().__init__(msg)
+		self.archived_pages = archived_pages
 
 class Controller():
 	def __init__(self, app):
@@ -39,6 +56,15 @@ class Controller():
 		self._basedir = os.path.dirname(__file__)
 		self._acdb = None
 		self._doclib = doclib.DocLibrary()
+		self._incoming = None
+		self._jobserver = None
+		self._ocr_jobserver = None
+		self._rotation_pool = None
+		self._renditions = None
+		self._ocr_processor = None
+		self._reserved = set()
+		self._reserved_lock = threading.Lock()
+		self._docfile_lock = threading.Lock()
 
 	def _late_init(self):
 		# Now config is available
@@ -51,6 +77,18 @@ class Controller():
 		with contextlib.suppress(FileExistsError):
 			os.makedirs(self._config["processed_dir"])
 		self._acdb = AutocompleteDB(self._config["autocomplete_config"])
+		self._acdb.attach_library(self._doclib)
+		atexit.register(self._acdb.flush)
+		self._incoming = IncomingIndex(self._config["incoming_dir"])
+		self._jobserver = JobServer(concurrent_jobs = self._config.get("job_threads", 2))
+		self._rotation_pool = concurrent.futures.ThreadPoolExecutor(max_workers = self._config.get("rotation_threads", os.cpu_count()))
+		self._renditions = RenditionCache(self._config.get("rendition_cache_dir", self._config["thumb_dir"] + "/renditions"), max_size = self._config.get("rendition_cache_size", 256 * 1024 * 1024))
+		if self._config.get("ocr_after_create", False):
+			ocr_executor = concurrent.futures.ThreadPoolExecutor(max_workers = self._config.get("ocr_threads", 2))
+			self._ocr_processor = doclib.OCRProcessor(doclib.TesseractOCR(language = self._config.get("ocr_language", "eng")), ocr_executor, max_in_flight = self._config.get("ocr_threads", 2))
+			# Separate queue, so that long running text recognition never
+			# delays the creation of documents
+			self._ocr_jobserver = JobServer(concurrent_jobs = 1)
 		self._doclib.add_directory(self._config["doc_dir"])
 
 	@property
@@ -70,16 +108,68 @@ class Controller():
 		return self._basedir + "/static"
 
 	def list_incoming(self):
-		incoming_files = [ filename for filename in os.listdir(self._config["incoming_dir"]) if filename.endswith(".png") ]
-		incoming_files.sort()
-		return incoming_files
+		with self._reserved_lock:
+			reserved = set(self._reserved)
+		return [ dict(entry, reserved = entry["filename"] in reserved) for entry in self._incoming.get_entries() ]
+
+	def _rotate_thumb(self, filename, degrees):
+		thumb_filename = self.get_thumb_filename_for(filename)
+		if not os.path.isfile(thumb_filename):
+			return
+		try:
+			with tempfile.NamedTemporaryFile(suffix = ".jpg", dir = self._config["thumb_dir"], delete = False) as outfile:
+				doclib.metrics.check_call([ "convert", "-rotate", str(degrees), thumb_filename, outfile.name ])
+				os.rename(outfile.name, thumb_filename)
+		except subprocess.CalledProcessError:
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(outfile.name)
+			self.remove_thumb(filename)
 
 	def rotate(self, filename, degrees):
 		input_filename = self._config["incoming_dir"] + "/" + filename
+		try:
+			text_chunks = doclib.PNGReader(input_filename).get_text_chunks()
+		except doclib.PNGReaderException:
+			text_chunks = None
 		with tempfile.NamedTemporaryFile(suffix = ".png", delete = False) as outfile:
-			subprocess.check_call([ "convert", "-rotate", str(degrees), input_filename, outfile.name ])
-			shutil.move(outfile.name, input_filename)
-			self.remove_thumb(filename)
+			doclib.metrics.check_call([ "convert", "-rotate", str(degrees), input_filename, outfile.name ])
+			if text_chunks is not None:
+				# Do not rely on ImageMagick to retain the embedded JSON
+				# metadata, transplant the original text chunks instead
+				doclib.PNGReader(outfile.name).replace_text_chunks(text_chunks, input_filename + "_")
+				os.unlink(outfile.name)
+				os.rename(input_filename + "_", input_filename)
+			else:
+				shutil.move(outfile.name, input_filename)
+		self._renditions.invalidate(input_filename)
+		self._rotate_thumb(filename, degrees)
+
+	def rotate_batch(self, rotations):
+		# Multiple rotations of the same file are combined, they must not run
+		# concurrently on the same file
+		degrees_by_filename = { }
+		for (filename, degrees) in rotations:
+			degrees_by_filename[filename] = (degrees_by_filename.get(filename, 0) + degrees) % 360
+
+		with self._reserved_lock:
+			reserved = set(self._reserved)
+		results = { }
+		futures = { }
+		for (filename, degrees) in degrees_by_filename.items():
+			if (os.path.basename(filename) != filename) or (filename in reserved):
+				results[filename] = False
+			elif degrees == 0:
+				results[filename] = True
+			else:
+				futures[filename] = self._rotation_pool.submit(self.rotate, filename, degrees)
+
+		for (filename, future) in futures.items():
+			try:
+				future.result()
+				results[filename] = True
+			except (OSError, subprocess.CalledProcessError, doclib.PNGReaderException):
+				results[filename] = False
+		return results
 
 	@staticmethod
 	def _sanitize_filename(filename):
@@ -113,7 +203,11 @@ class Controller():
 
 	def delete_incoming(self, filelist):
 		result = { }
-		return { filename: self._delete_file(self._config["incoming_dir"] + "/" + filename) for filename in filelist }
+		for filename in filelist:
+			full_filename = self._config["incoming_dir"] + "/" + filename
+			self._renditions.invalidate(full_filename)
+			result[filename] = self._delete_file(full_filename)
+		return result
 
 	def get_thumb_filename_for(self, filename):
 		thumb_filename = self._config["thumb_dir"] + "/" + filename
@@ -127,12 +221,81 @@ class Controller():
 
 	def get_thumb(self, filename):
 		thumb_filename = self.get_thumb_filename_for(filename)
-		if not os.path.isfile(thumb_filename):
+		thumb_present = os.path.isfile(thumb_filename)
+		doclib.metrics.cache_access("thumbnail", thumb_present)
+		if not thumb_present:
 			src_filename = self._config["incoming_dir"] + "/" + filename
-			subprocess.check_call([ "convert", "-quality", "80", "-resize", "200x300", src_filename, thumb_filename ])
+			doclib.metrics.check_call([ "convert", "-quality", "80", "-resize", "200x300", src_filename, thumb_filename ])
 		return os.path.basename(thumb_filename)
 
-	def create_document(self, filenames, tags = None, attributes = None):
+	@property
+	def rendition_dir(self):
+		return self._renditions.cache_dir
+
+	def get_rendition(self, filename, width, height, quality = 80, image_format = "jpeg"):
+		src_filename = self._config["incoming_dir"] + "/" + filename
+		if (os.path.basename(filename) != filename) or (not os.path.isfile(src_filename)):
+			return None
+		return self._renditions.get(src_filename, width, height, quality = quality, image_format = image_format)
+
+	def _reserve(self, filenames):
+		with self._reserved_lock:
+			already_reserved = self._reserved & set(filenames)
+			if len(already_reserved) > 0:
+				raise FilesReservedException("Files already part of a pending document: %s" % (", ".join(sorted(already_reserved))))
+			self._reserved |= set(filenames)
+
+	def _release(self, filenames):
+		with self._reserved_lock:
+			self._reserved -= set(filenames)
+
+	def get_job(self, job_id):
+		job = self._jobserver.get(job_id)
+		if (job is None) and (self._ocr_jobserver is not None):
+			job = self._ocr_jobserver.get(job_id)
+		return job
+
+	@staticmethod
+	def _hash_file(filename):
+		hasher = hashlib.sha256()
+		with open(filename, "rb") as f:
+			while True:
+				chunk = f.read(1024 * 1024)
+				if len(chunk) == 0:
+					break
+				hasher.update(chunk)
+		return hasher.hexdigest()
+
+	def find_archived_pages(self, filenames):
+		self._doclib.rescan()
+		result = { }
+		for filename in filenames:
+			img_hash = self._hash_file(self._config["incoming_dir"] + "/" + filename)
+			matches = self._doclib.find_page(img_hash)
+			if len(matches) > 0:
+				result[filename] = [ { "doc_uuid": entry.doc_uuid, "side_uuid": side_uuid, "filename": os.path.basename(entry.filename) } for (entry, side_uuid) in matches ]
+		return result
+
+	def submit_create_document(self, filenames, tags = None, attributes = None, allow_archived = False):
+		if not allow_archived:
+			archived_pages = self.find_archived_pages(filenames)
+			if len(archived_pages) > 0:
+				raise PagesAlreadyArchivedException("%d page(s) already archived: %s" % (len(archived_pages), ", ".join(sorted(archived_pages))), archived_pages)
+		self._reserve(filenames)
+		try:
+			job = self._jobserver.submit("create_document", self._create_document_job, (filenames, tags, attributes))
+		except:
+			self._release(filenames)
+			raise
+		return job
+
+	def _create_document_job(self, job, filenames, tags, attributes):
+		try:
+			return self.create_document(filenames, tags, attributes, job = job)
+		finally:
+			self._release(filenames)
+
+	def create_document(self, filenames, tags = None, attributes = None, job = None):
 		if tags is None:
 			tags = [ ]
 		if attributes is None:
@@ -146,13 +309,15 @@ class Controller():
 			fn_elements.append(attributes["peer"].replace(" ", "_"))
 		if "docname" in attributes:
 			fn_elements.append(attributes["docname"].replace(" ", "_"))
-		self.acdb.put_peer_docname(attributes.get("peer"), attributes.get("docname"))
-		self.acdb.put_tags(tags)
-		self.acdb.write()
-
-		output_doc = self._find_filename(self._config["doc_dir"], "-".join(fn_elements) + ".mud")
-		with doclib.MultiDoc(output_doc) as doc:
-			for filename in filenames:
+		with self._docfile_lock:
+			# Creating the MUD claims the filename, so concurrent jobs cannot
+			# end up choosing the same one
+			output_doc = self._find_filename(self._config["doc_dir"], "-".join(fn_elements) + ".mud")
+			doc = doclib.MultiDoc(output_doc)
+		with doc:
+			for (fileno, filename) in enumerate(filenames):
+				if job is not None:
+					job.set_progress(fileno, len(filenames))
 				full_filename = self._config["incoming_dir"] + "/" + filename
 				try:
 					meta = doclib.MetaReader(full_filename).read()
@@ -163,16 +328,107 @@ class Controller():
 				for attribute in [ "batch_uuid", "created_utc", "scanned_page_no" ]:
 					if attribute in meta:
 						doc.set_side_property(side_uuid, attribute, str(meta[attribute]))
+				with open(full_filename, "rb") as f:
+					doc.add_thumbnails(side_uuid, img_data = f.read())
 
-			doc.set_document_property("doc_uuid", str(uuid.uuid4()))
+			doc_uuid = str(uuid.uuid4())
+			doc.set_document_property("doc_uuid", doc_uuid)
 			doc.set_document_property("created_utc", datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"))
 			for (key, value) in attributes.items():
 				doc.set_document_property(key, value)
 			for tag in tags:
 				doc.add_tag(tag)
+		self._doclib.refresh_document(output_doc)
 		for filename in filenames:
 			self._move_file(self._config["incoming_dir"] + "/" + filename, self._config["processed_dir"])
-		return { "success": True }
+		if job is not None:
+			job.set_progress(len(filenames), len(filenames))
+		result = { "success": True, "filename": os.path.basename(output_doc) }
+		if self._ocr_processor is not None:
+			result["ocr_job_id"] = self._ocr_jobserver.submit("ocr", self._ocr_job, (doc_uuid, )).job_id
+		return result
+
+	def _ocr_job(self, job, doc_uuid):
+		with self._docfile_lock:
+			# Opened while holding the lock, since opening a file that was
+			# removed in the meantime would create an empty MUD in its place
+			filename = self._get_document_filename(doc_uuid)
+			doc = doclib.MultiDoc(filename)
+		with doc:
+			(results, stats) = self._ocr_processor.recognize_document(doc, progress_callback = job.set_progress)
+		with self._docfile_lock:
+			# The document may have been renamed or split while being
+			# recognized, so it is looked up again before writing
+			filename = self._get_document_filename(doc_uuid)
+			with doclib.MultiDoc(filename) as doc:
+				stats["pages"] = self._ocr_processor.store_results(doc, results)
+			self._doclib.refresh_document(filename)
+		return {
+			"success":			stats["failed"] == 0,
+			"filename":			os.path.basename(filename),
+			"pages":			stats["pages"],
+			"skipped":			stats["skipped"],
+			"failed":			stats["failed"],
+			"pages_per_minute":	stats["pages"] / stats["seconds"] * 60 if (stats["seconds"] > 0) else 0,
+		}
+
+	def _get_document_filename(self, doc_uuid):
+		self._doclib.rescan()
+		entry = self._doclib.doc_dict.get(doc_uuid)
+		if entry is None:
+			raise NoSuchDocumentException("No document with UUID %s in library." % (doc_uuid))
+		return entry.filename
+
+	def merge_documents(self, doc_uuid, source_doc_uuids):
+		with self._docfile_lock:
+			target_filename = self._get_document_filename(doc_uuid)
+			source_filenames = [ self._get_document_filename(source_doc_uuid) for source_doc_uuid in source_doc_uuids ]
+			if target_filename in source_filenames:
+				raise InvalidDocumentOperationException("Cannot merge document %s into itself." % (doc_uuid))
+			with doclib.MultiDoc(target_filename) as doc:
+				try:
+					doc.merge_documents(source_filenames)
+				except sqlite3.IntegrityError as e:
+					raise InvalidDocumentOperationException("Cannot merge into %s: %s" % (os.path.basename(target_filename), str(e)))
+			# Sources are only discarded once all their pages are committed
+			# to the target
+			for source_filename in source_filenames:
+				self._delete_file(source_filename)
+				self._doclib.remove_document(source_filename)
+			self._doclib.refresh_document(target_filename)
+		return { "success": True, "filename": os.path.basename(target_filename) }
+
+	def split_document(self, doc_uuid, split_side_uuids):
+		with self._docfile_lock:
+			filename = self._get_document_filename(doc_uuid)
+			output_filenames = [ ]
+			with doclib.MultiDoc(filename) as doc:
+				page_order = doc.get_page_order()
+				if any((side_uuid not in page_order) or (side_uuid == page_order[0]) for side_uuid in split_side_uuids):
+					raise InvalidDocumentOperationException("Split points must be pages of document %s other than the first one." % (doc_uuid))
+				boundaries = sorted(set(page_order.index(side_uuid) for side_uuid in split_side_uuids)) + [ len(page_order) ]
+				for (partno, (start, end)) in enumerate(zip(boundaries, boundaries[1:]), 2):
+					output_filenames.append(self._find_filename(self._config["doc_dir"], "%s_part%02d.mud" % (os.path.splitext(os.path.basename(filename))[0], partno)))
+				# Split off from the back, so that the remaining page order
+				# stays valid
+				for ((start, end), output_filename) in reversed(list(zip(zip(boundaries, boundaries[1:]), output_filenames))):
+					doc.split_off(page_order[start : end], output_filename)
+			self._doclib.refresh_document(filename)
+			for output_filename in output_filenames:
+				self._doclib.refresh_document(output_filename)
+		return { "success": True, "filenames": [ os.path.basename(filename) ] + [ os.path.basename(output_filename) for output_filename in output_filenames ] }
+
+	def reorder_document(self, doc_uuid, side_uuids):
+		with self._docfile_lock:
+			filename = self._get_document_filename(doc_uuid)
+			with doclib.MultiDoc(filename) as doc:
+				try:
+					doc.reorder_pages(side_uuids)
+				except ValueError as e:
+					raise InvalidDocumentOperationException(str(e))
+			self._doclib.refresh_document(filename)
+		return { "success": True, "filename": os.path.basename(filename) }
 
 	def list_documents(self):
+		self._doclib.rescan()
 		return { doc_uuid: doc_entry.metadata for (doc_uuid, doc_entry) in self._doclib }
@@ -0,0 +1,105 @@
+#	bulkscan - Document scanning and maintenance solution
+#	Copyright (C) 2019-2023 Johannes Bauer
+#
+#	This file is part of bulkscan.
+#
+#	bulkscan is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	bulkscan is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with bulkscan; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import bisect
+import threading
+import doclib
+
+class IncomingEntry():
+	def __init__(self, dirent):
+		self._filename = dirent.name
+		stat = dirent.stat()
+		self._mtime_ns = stat.st_mtime_ns
+		self._size = stat.st_size
+		self._info = self._parse(dirent.path)
+
+	@property
+	def filename(self):
+		return self._filename
+
+	@property
+	def info(self):
+		return self._info
+
+	def changed(self, dirent):
+		stat = dirent.stat()
+		return (stat.st_mtime_ns != self._mtime_ns) or (stat.st_size != self._size)
+
+	def _parse(self, full_filename):
+		info = {
+			"filename":		self._filename,
+			"size":			self._size,
+			"mtime":		self._mtime_ns / 1e9,
+		}
+		try:
+			png_info = doclib.PNGReader(full_filename).read()
+		except (OSError, doclib.PNGReaderException):
+			return info
+
+		info["width"] = png_info.width
+		info["height"] = png_info.height
+		info["resolution_dpi"] = png_info.resolution_dpi
+		try:
+			meta = json.loads(png_info.text.get("comment", ""))
+		except json.JSONDecodeError:
+			meta = { }
+		if isinstance(meta, dict):
+			for key in [ "batch_uuid", "page_uuid", "side_uuid", "side", "scanned_page_no", "created_utc", "blank_page" ]:
+				info[key] = meta.get(key)
+		return info
+
+class IncomingIndex():
+	def __init__(self, dirname):
+		self._dirname = dirname
+		self._entries = { }
+		self._sorted_filenames = [ ]
+		self._lock = threading.Lock()
+
+	def _update(self):
+		present = set()
+		with os.scandir(self._dirname) as it:
+			for dirent in it:
+				if (not dirent.name.endswith(".png")) or (not dirent.is_file()):
+					continue
+				present.add(dirent.name)
+				entry = self._entries.get(dirent.name)
+				if entry is None:
+					doclib.metrics.cache_access("incoming_index", False)
+					self._entries[dirent.name] = IncomingEntry(dirent)
+					bisect.insort(self._sorted_filenames, dirent.name)
+				elif entry.changed(dirent):
+					doclib.metrics.cache_access("incoming_index", False)
+					self._entries[dirent.name] = IncomingEntry(dirent)
+				else:
+					doclib.metrics.cache_access("incoming_index", True)
+
+		removed = self._entries.keys() - present
+		if len(removed) > 0:
+			for filename in removed:
+				del self._entries[filename]
+			self._sorted_filenames = [ filename for filename in self._sorted_filenames if filename not in removed ]
+
+	def get_entries(self):
+		with self._lock:
+			self._update()
+			return [ self._entries[filename].info for filename in self._sorted_filenames ]
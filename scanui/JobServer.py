@@ -0,0 +1,111 @@
+#	bulkscan - Document scanning and maintenance solution
+#	Copyright (C) 2019-2023 Johannes Bauer
+#
+#	This file is part of bulkscan.
+#
+#	bulkscan is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	bulkscan is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with bulkscan; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import time
+import uuid
+import queue
+import threading
+import traceback
+import collections
+
+class Job():
+	def __init__(self, name, thread_fnc, thread_args):
+		self._job_id = str(uuid.uuid4())
+		self._name = name
+		self._thread_fnc = thread_fnc
+		self._thread_args = thread_args
+		self._status = "queued"
+		self._progress = (0, None)
+		self._result = None
+		self._error = None
+		self._times = {
+			"created":	time.time(),
+			"started":	None,
+			"finished":	None,
+		}
+
+	@property
+	def job_id(self):
+		return self._job_id
+
+	@property
+	def finished(self):
+		return self._status in [ "finished", "failed" ]
+
+	def set_progress(self, done, total = None):
+		self._progress = (done, total)
+
+	def run(self):
+		self._status = "running"
+		self._times["started"] = time.time()
+		try:
+			self._result = self._thread_fnc(self, *self._thread_args)
+			self._status = "finished"
+		except Exception as e:
+			traceback.print_exc(file = sys.stderr)
+			self._error = "%s: %s" % (e.__class__.__name__, str(e))
+			self._status = "failed"
+		finally:
+			self._times["finished"] = time.time()
+
+	def to_dict(self):
+		return {
+			"job_id":		self._job_id,
+			"name":			self._name,
+			"status":		self._status,
+			"progress":		{ "done": self._progress[0], "total": self._progress[1] },
+			"result":		self._result,
+			"error":		self._error,
+			"times":		dict(self._times),
+		}
+
+class JobServer():
+	def __init__(self, concurrent_jobs = 2, keep_finished = 100):
+		self._queue = queue.Queue()
+		self._jobs = collections.OrderedDict()
+		self._keep_finished = keep_finished
+		self._lock = threading.Lock()
+		self._threads = [ threading.Thread(target = self._thread_function, daemon = True) for i in range(concurrent_jobs) ]
+		for thread in self._threads:
+			thread.start()
+
+	def _prune(self):
+		finished = [ job_id for (job_id, job) in self._jobs.items() if job.finished ]
+		for job_id in finished[:-self._keep_finished]:
+			del self._jobs[job_id]
+
+	def submit(self, name, thread_fnc, thread_args = None):
+		job = Job(name, thread_fnc, thread_args or ())
+		with self._lock:
+			self._prune()
+			self._jobs[job.job_id] = job
+		self._queue.put(job)
+		return job
+
+	def get(self, job_id):
+		with self._lock:
+			return self._jobs.get(job_id)
+
+	def _thread_function(self):
+		while True:
+			job = self._queue.get()
+			job.run()
@@ -0,0 +1,126 @@
+#	bulkscan - Document scanning and maintenance solution
+#	Copyright (C) 2019-2023 Johannes Bauer
+#
+#	This file is part of bulkscan.
+#
+#	bulkscan is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	bulkscan is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with bulkscan; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import hashlib
+import threading
+import contextlib
+import collections
+import doclib
+
+class RenditionCache():
+	def __init__(self, cache_dir, max_size):
+		self._cache_dir = cache_dir
+		self._max_size = max_size
+		self._lock = threading.Lock()
+		self._entries = collections.OrderedDict()
+		self._keys_by_source = collections.defaultdict(set)
+		self._pending = { }
+		self._total_size = 0
+		with contextlib.suppress(FileExistsError):
+			os.makedirs(self._cache_dir)
+		self._load()
+
+	@property
+	def cache_dir(self):
+		return self._cache_dir
+
+	def _load(self):
+		# Access time of cached files is kept in their mtime, so the LRU order
+		# survives restarts
+		existing = [ ]
+		with os.scandir(self._cache_dir) as it:
+			for dirent in it:
+				if dirent.is_file() and (not dirent.name.endswith("_")):
+					stat = dirent.stat()
+					existing.append((stat.st_mtime, dirent.name, stat.st_size))
+		existing.sort()
+		for (mtime, name, size) in existing:
+			self._entries[name] = size
+			self._total_size += size
+		self._evict()
+
+	def _evict(self):
+		while (self._total_size > self._max_size) and (len(self._entries) > 0):
+			(name, size) = self._entries.popitem(last = False)
+			self._total_size -= size
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(self._cache_dir + "/" + name)
+
+	@staticmethod
+	def _cache_name(source_filename, width, height, quality, image_format):
+		stat = os.stat(source_filename)
+		key = "%s|%d|%d|%d|%d|%d|%s" % (source_filename, stat.st_mtime_ns, stat.st_size, width, height, quality, image_format)
+		return hashlib.sha256(key.encode("utf-8")).hexdigest() + "." + image_format
+
+	def _render(self, source_filename, name, width, height, quality, image_format):
+		tmp_filename = self._cache_dir + "/" + name + "_"
+		try:
+			doclib.metrics.check_call([ "convert", source_filename, "-resize", "%dx%d>" % (width, height), "-quality", str(quality), "%s:%s" % (image_format, tmp_filename) ])
+			os.rename(tmp_filename, self._cache_dir + "/" + name)
+		finally:
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(tmp_filename)
+		return os.stat(self._cache_dir + "/" + name).st_size
+
+	def get(self, source_filename, width, height, quality = 80, image_format = "jpeg"):
+		name = self._cache_name(source_filename, width, height, quality, image_format)
+		while True:
+			with self._lock:
+				if name in self._entries:
+					self._entries.move_to_end(name)
+					with contextlib.suppress(FileNotFoundError):
+						os.utime(self._cache_dir + "/" + name)
+						doclib.metrics.cache_access("rendition", True)
+						return name
+					# Vanished from disk behind our back
+					self._total_size -= self._entries.pop(name)
+
+				pending = self._pending.get(name)
+				if pending is None:
+					self._pending[name] = threading.Event()
+					break
+			# Identical rendition is being created by another thread already,
+			# wait for it instead of creating it twice
+			doclib.metrics.count("rendition_coalesced_total")
+			pending.wait()
+
+		doclib.metrics.cache_access("rendition", False)
+		try:
+			size = self._render(source_filename, name, width, height, quality, image_format)
+			with self._lock:
+				self._entries[name] = size
+				self._keys_by_source[source_filename].add(name)
+				self._total_size += size
+				self._evict()
+		finally:
+			with self._lock:
+				self._pending.pop(name).set()
+		return name
+
+	def invalidate(self, source_filename):
+		with self._lock:
+			for name in self._keys_by_source.pop(source_filename, set()):
+				size = self._entries.pop(name, None)
+				if size is not None:
+					self._total_size -= size
+					with contextlib.suppress(FileNotFoundError):
+						os.unlink(self._cache_dir + "/" + name)
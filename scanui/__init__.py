@@ -21,14 +21,33 @@
 
 import os
 import json
-from flask import Flask, send_file, send_from_directory, jsonify, request, abort, redirect
-from .Controller import Controller
+import time
+import flask
+from flask import Flask, send_file, send_from_directory, request, abort, redirect, g, Response
+import doclib
+from .Controller import Controller, FilesReservedException, PagesAlreadyArchivedException, NoSuchDocumentException, InvalidDocumentOperationException
 from .Debug import Debug
 
 app = Flask(__name__)
 ctrlr = Controller(app)
 dbg = Debug()
 
+def jsonify(*args, **kwargs):
+	with doclib.metrics.timed("json_encode_duration_seconds"):
+		return flask.jsonify(*args, **kwargs)
+
+@app.before_request
+def metrics_before_request():
+	g.request_start = time.perf_counter()
+
+@app.after_request
+def metrics_after_request(response):
+	endpoint = request.url_rule.rule if (request.url_rule is not None) else "unmatched"
+	doclib.metrics.observe("http_request_duration_seconds", time.perf_counter() - g.request_start, endpoint = endpoint, method = request.method, status = response.status_code)
+	if response.content_length is not None:
+		doclib.metrics.count("http_response_bytes_total", response.content_length, endpoint = endpoint)
+	return response
+
 @app.route("/")
 def index():
 	return redirect("/static/html/incoming.html")
@@ -63,24 +82,102 @@ def incoming_action(action, filename):
 		abort(400)
 	return jsonify({ "status": "OK" })
 
+@app.route("/incoming/rotate", methods = [ "POST" ])
+def incoming_rotate():
+	rotations = [ ]
+	for (filename, degrees) in request.json:
+		if (not isinstance(degrees, int)) or ((degrees % 90) != 0):
+			abort(400)
+		rotations.append((filename, degrees))
+	return jsonify(ctrlr.rotate_batch(rotations))
+
 # TODO SANITIZE FILENAME
 @app.route("/incoming/image/<filename>")
 def incoming_image(filename):
 	return send_from_directory(ctrlr.config["incoming_dir"], filename, max_age = 0)
 
+@app.route("/incoming/rendition/<filename>")
+def incoming_rendition(filename):
+	try:
+		width = int(request.args.get("width", "1600"))
+		height = int(request.args.get("height", "1600"))
+		quality = int(request.args.get("quality", "80"))
+	except ValueError:
+		abort(400)
+	image_format = request.args.get("format", "jpeg")
+	if (not (16 <= width <= 8192)) or (not (16 <= height <= 8192)) or (not (1 <= quality <= 100)) or (image_format not in [ "jpeg", "webp" ]):
+		abort(400)
+	rendition_filename = ctrlr.get_rendition(filename, width, height, quality = quality, image_format = image_format)
+	if rendition_filename is None:
+		abort(404)
+	return send_from_directory(ctrlr.rendition_dir, rendition_filename, max_age = 0)
+
 @app.route("/autocompletion")
 def autocompletion():
 	return jsonify(ctrlr.acdb.get_all())
 
+@app.route("/autocompletion/<category>")
+def autocompletion_query(category):
+	prefix = request.args.get("prefix", "")
+	limit = request.args.get("limit", 25, type = int)
+	if category == "tag":
+		result = ctrlr.acdb.query_tag(prefix, limit = limit)
+	elif category == "peer":
+		result = ctrlr.acdb.query_peer(prefix, limit = limit)
+	elif category == "docname":
+		result = ctrlr.acdb.query_docname(prefix, limit = limit, peer = request.args.get("peer"))
+	else:
+		abort(404)
+	return jsonify(result)
+
 @app.route("/document", methods = [ "POST" ])
 def document_create():
 	indata = request.json
-	return jsonify(ctrlr.create_document(indata["files"], indata["tags"], indata["attrs"]))
+	try:
+		job = ctrlr.submit_create_document(indata["files"], indata["tags"], indata["attrs"], allow_archived = indata.get("allow_archived", False))
+	except FilesReservedException as e:
+		return jsonify({ "success": False, "error": str(e) }), 409
+	except PagesAlreadyArchivedException as e:
+		return jsonify({ "success": False, "error": str(e), "archived_pages": e.archived_pages }), 409
+	return jsonify({ "success": True, "job_id": job.job_id }), 202
 
 @app.route("/document")
 def document_list():
 	return jsonify(ctrlr.list_documents())
 
+@app.route("/document/<doc_uuid>/<action>", methods = [ "POST" ])
+def document_action(doc_uuid, action):
+	indata = request.json
+	try:
+		if action == "merge":
+			result = ctrlr.merge_documents(doc_uuid, indata["sources"])
+		elif action == "split":
+			result = ctrlr.split_document(doc_uuid, indata["at"])
+		elif action == "reorder":
+			result = ctrlr.reorder_document(doc_uuid, indata["order"])
+		else:
+			abort(400)
+	except NoSuchDocumentException as e:
+		return jsonify({ "success": False, "error": str(e) }), 404
+	except InvalidDocumentOperationException as e:
+		return jsonify({ "success": False, "error": str(e) }), 400
+	return jsonify(result)
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+	job = ctrlr.get_job(job_id)
+	if job is None:
+		abort(404)
+	return jsonify(job.to_dict())
+
+@app.route("/metrics")
+def metrics_prometheus():
+	return Response(doclib.metrics.to_prometheus(), mimetype = "text/plain; version=0.0.4")
+
+@app.route("/metrics/json")
+def metrics_json():
+	return jsonify(doclib.metrics.to_dict())
+
 @app.route("/debug")
 def debug():
 	return jsonify(dbg.get())
@@ -42,7 +42,49 @@ function send_delete_images(filelist) {
 	thumbnails.remove_selected();
 }
 
-function send_create_document(document_data) {
+function document_creation_failed(filenames, error) {
+	thumbnails.set_reserved(filenames, false);
+	thumbnails.select_filenames(filenames);
+	alert("Document creation failed: " + error);
+}
+
+function watch_job(job_id, filenames) {
+	fetch("/jobs/" + job_id).then(function(response) {
+		if (response.status != 200) {
+			throw new Error("job status returned HTTP " + response.status);
+		}
+		return response.json();
+	}).then(function(job) {
+		if (job["status"] == "finished") {
+			thumbnails.remove_filenames(filenames);
+		} else if (job["status"] == "failed") {
+			document_creation_failed(filenames, job["error"]);
+		} else {
+			setTimeout(() => watch_job(job_id, filenames), 1000);
+		}
+	}).catch(function(error) {
+		document_creation_failed(filenames, error.message);
+	});
+}
+
+function watch_reserved() {
+	/* Pages that were already part of a pending document when the page was
+	 * loaded; there is no job to follow for them, so the list is polled */
+	if (thumbnails.get_reserved_filenames().length == 0) {
+		return;
+	}
+	fetch("/incoming/list").then((response) => response.json()).then(function(incoming_list) {
+		const entries = new Map(incoming_list.map((entry) => [ entry["filename"], entry ]));
+		const reserved = thumbnails.get_reserved_filenames();
+		thumbnails.remove_filenames(reserved.filter((filename) => !entries.has(filename)));
+		thumbnails.set_reserved(reserved.filter((filename) => entries.has(filename) && !entries.get(filename)["reserved"]), false);
+		setTimeout(watch_reserved, 2000);
+	});
+}
+
+function post_document(document_data) {
+	/* Pages are kept, but cannot be selected, while the document is created
+	 * in the background. They are only removed once the job has finished. */
 	fetch("/document", {
 		method: "POST",
 		headers: {
@@ -50,8 +92,23 @@ function send_create_document(document_data) {
 			"Content-Type":	"application/json",
 		},
 		body: JSON.stringify(document_data),
+	}).then(function(response) {
+		if (response.status == 202) {
+			thumbnails.set_reserved(document_data["files"], true);
+			response.json().then((result) => watch_job(result["job_id"], document_data["files"]));
+			return;
+		}
+		response.json().then(function(result) {
+			if (result["archived_pages"] && !document_data["allow_archived"]) {
+				const pages = Object.keys(result["archived_pages"]).map(filename => filename + " (in " + result["archived_pages"][filename].map(match => match["filename"]).join(", ") + ")");
+				if (confirm("These pages are already archived:\n" + pages.join("\n") + "\n\nCreate the document anyway?")) {
+					post_document(Object.assign({ "allow_archived": true }, document_data));
+				}
+			} else {
+				console.log("Document creation was rejected:", response.status, result["error"]);
+			}
+		});
 	});
-	thumbnails.remove_selected();
 }
 
 function action_create_document() {
@@ -59,7 +116,7 @@ function action_create_document() {
 	active_modal.run(function(result) {
 		if (result["resultcode"]) {
 			/* Create document! */
-			send_create_document(result["data"]);
+			post_document(result["data"]);
 		}
 		active_modal = null;
 	});
@@ -134,7 +191,8 @@ fetch("/incoming/list").then(function(response) {
 	if (response.status == 200) {
 		return response.json();
 	}
-}).then(function(filename_list) {
+}).then(function(incoming_list) {
+	const filename_list = incoming_list.map((entry) => entry["filename"]);
 	const options = {
 		selectable:	true,
 		lazy_loading: true,
@@ -142,5 +200,7 @@ fetch("/incoming/list").then(function(response) {
 	};
 	thumbnails = new PageThumbnails(filename_list, options);
 	thumbnails.populate_container(elem_showarea);
+	thumbnails.set_reserved(incoming_list.filter((entry) => entry["reserved"]).map((entry) => entry["filename"]), true);
+	watch_reserved();
 	elem_content.style.display = "";
 });
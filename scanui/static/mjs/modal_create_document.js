@@ -32,33 +32,35 @@ export class CreateDocumentModal extends Modal {
 		this._filenames = filenames;
 		this._thumbnails = null;
 		this._active_modal = null;
-		this._autocomplete_data = null;
 	}
 
-	_autocomplete_simple(term, suggestion_source) {
-		const lc_term = term.toLowerCase();
-		const suggestion = [ ];
-		for (const tag of suggestion_source) {
-			if (tag.toLowerCase().startsWith(lc_term)) {
-				suggestion.push(tag);
+	_autocomplete_query(category, term, suggest, params) {
+		const query = new URLSearchParams(params);
+		query.set("prefix", term);
+		fetch("/autocompletion/" + category + "?" + query.toString()).then(function(response) {
+			if (response.status == 200) {
+				return response.json();
 			}
-		}
-		return suggestion;
+		}).then(function(suggestion) {
+			if (suggestion) {
+				suggest(suggestion);
+			}
+		});
 	}
 
 	_autocomplete_peer(term, suggest) {
-		suggest(this._autocomplete_simple(term, Object.keys(this._autocomplete_data["docname_by_peer"])));
+		this._autocomplete_query("peer", term, suggest, { });
 	}
 
 	_autocomplete_docname(term, suggest) {
 		const peer = this.div.querySelector("#create_peer").value;
-		if (peer in this._autocomplete_data["docname_by_peer"]) {
-			suggest(this._autocomplete_simple(term, this._autocomplete_data["docname_by_peer"][peer]));
+		if (peer != "") {
+			this._autocomplete_query("docname", term, suggest, { "peer": peer });
 		}
 	}
 
 	_autocomplete_tags(term, suggest) {
-		suggest(this._autocomplete_simple(term, this._autocomplete_data["tag"]));
+		this._autocomplete_query("tag", term, suggest, { });
 	}
 
 	_create_autocompleter(element, choices) {
@@ -159,16 +161,9 @@ export class CreateDocumentModal extends Modal {
 		this._thumbnails.populate_container(this._div.querySelector(".container"));
 		this.div.querySelector("#create_pagecnt").innerText = this._filenames.length;
 
-		fetch("/autocompletion").then(function(response) {
-			if (response.status == 200) {
-				return response.json();
-			}
-		}).then(function(autocomplete_data) {
-			create_doc_modal._autocomplete_data = autocomplete_data;
-			new autoComplete({ selector: create_doc_modal.div.querySelector("#create_peer"), minChars: 1, delay: 0, source: (term, suggest) => create_doc_modal._autocomplete_peer(term, suggest) });
-			new autoComplete({ selector: create_doc_modal.div.querySelector("#create_docname"), minChars: 0, delay: 0, source: (term, suggest) => create_doc_modal._autocomplete_docname(term, suggest), cache: false });
-			new autoComplete({ selector: create_doc_modal.div.querySelector("#create_tags"), minChars: 1, delay: 0, source: (term, suggest) => create_doc_modal._autocomplete_tags(term, suggest) });
-		});
+		new autoComplete({ selector: this.div.querySelector("#create_peer"), minChars: 1, delay: 0, source: (term, suggest) => this._autocomplete_peer(term, suggest) });
+		new autoComplete({ selector: this.div.querySelector("#create_docname"), minChars: 0, delay: 0, source: (term, suggest) => this._autocomplete_docname(term, suggest), cache: false });
+		new autoComplete({ selector: this.div.querySelector("#create_tags"), minChars: 1, delay: 0, source: (term, suggest) => this._autocomplete_tags(term, suggest) });
 
 		this.div.querySelectorAll(".plausibilize").forEach(function(element) { register_plausibilization(element, create_doc_modal.div); });
 	}
@@ -36,7 +36,12 @@ export class PreviewModal extends Modal {
 	}
 
 	_initialize() {
-		this.div.querySelector("img").src = "/incoming/image/" + this._thumbnail.filename;
+		/* Request a rendition that fits the screen instead of the full
+		 * resolution original */
+		const scale = window.devicePixelRatio || 1;
+		const width = Math.round(window.innerWidth * scale);
+		const height = Math.round(window.innerHeight * scale);
+		this.div.querySelector("img").src = "/incoming/rendition/" + encodeURIComponent(this._thumbnail.filename) + "?width=" + width + "&height=" + height + "&quality=80";
 		this.div.querySelector("#filename").innerText = this._thumbnail.filename;
 	}
 }
@@ -78,6 +78,8 @@ export class PageThumbnail {
 				/* Range click */
 				thumbnail.container.range_select(thumbnail);
 			}
+		} else if (this.classList.contains("reserved")) {
+			/* Part of a document that is being created */
 		} else {
 			if (thumbnail.options.selectable) {
 				/* Regular mouse click */
@@ -290,7 +292,9 @@ export class PageThumbnails {
 		}
 		let current = first_div;
 		while (current) {
-			current.classList.toggle("selected");
+			if (!current.classList.contains("reserved")) {
+				current.classList.toggle("selected");
+			}
 			if (current == last_div) {
 				break;
 			}
@@ -368,10 +372,47 @@ export class PageThumbnails {
 		this._last_clicked = null;
 	}
 
+	_thumbnails_for(filenames) {
+		const filename_set = new Set(filenames);
+		return this._thumbnails.filter((thumbnail) => filename_set.has(thumbnail.filename));
+	}
+
+	set_reserved(filenames, reserved) {
+		for (let thumbnail of this._thumbnails_for(filenames)) {
+			if (reserved) {
+				thumbnail.deselect();
+				thumbnail.div.classList.add("reserved");
+			} else {
+				thumbnail.div.classList.remove("reserved");
+			}
+		}
+	}
+
+	get_reserved_filenames() {
+		return this._thumbnails.filter((thumbnail) => thumbnail.div.classList.contains("reserved")).map((thumbnail) => thumbnail.filename);
+	}
+
+	select_filenames(filenames) {
+		for (let thumbnail of this._thumbnails_for(filenames)) {
+			thumbnail.select();
+		}
+	}
+
+	remove_filenames(filenames) {
+		for (let thumbnail of this._thumbnails_for(filenames)) {
+			thumbnail.div.remove();
+		}
+		this._update_remaining();
+	}
+
 	remove_selected() {
 		this._innerdiv.querySelectorAll("div.selected").forEach(function(div) {
 			div.remove();
 		});
+		this._update_remaining();
+	}
+
+	_update_remaining() {
 		const remaining_thumbnails = [ ];
 		this._innerdiv.querySelectorAll("div.selectable_img").forEach(function(div) {
 			remaining_thumbnails.push(div.thumbnail);